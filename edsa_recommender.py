@@ -33,12 +33,34 @@ import pandas as pd
 import numpy as np
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
+from utils.data_loader import SELECTBOX_RANGES, load_movie_titles
 from recommenders.collaborative_based import collab_model
 from recommenders.content_based import content_model
+from recommenders.hybrid_based import hybrid_model
+from utils import background, registry
+from utils.instrumentation import (counters, profile_call, reset, timings,
+                                   ENABLED as INSTRUMENTATION_ENABLED)
+from utils.result_cache import recommendation_cache
 
 # Data Loading
-title_list = load_movie_titles('resources/data/movies.csv')
+@st.cache_resource
+def cached_title_list():
+    """Load the movie titles once per process, shared by all sessions."""
+    return load_movie_titles('resources/data/movies.csv')
+
+@st.cache_resource
+def warm_resources():
+    """Start loading the data, indexes and models in the background.
+
+    Runs once per process, so the first recommendation does not pay for
+    loading them.
+
+    """
+    return background.warm(['movie_index', 'content_index', 'genre_index',
+                            'ratings_index', 'svd_factors', 'svd_index'])
+
+title_list = cached_title_list()
+warm_resources()
 
 # App declaration
 def main():
@@ -54,7 +76,7 @@ def main():
 
     # DO NOT REMOVE the 'Recommender System' option below, however,
     # you are welcome to add more options to enrich your app.
-    page_options = ["Home page", "Project summary","Explore the Data", "Recommender System","Solution Overview","Meet the Team", "Contact Us"]
+    page_options = ["Home page", "Project summary","Explore the Data", "Recommender System","Solution Overview","Meet the Team", "Contact Us", "Quick Recommender", "Diagnostics"]
 
     # -------------------------------------------------------------------
     # ----------- !! THIS CODE MUST NOT BE ALTERED !! -------------------
@@ -178,6 +200,78 @@ def main():
         st.markdown('* Instagram: @ReelInsights')
         st.markdown('* Address: 11 Adriana Cres, Rooihuiskraal, Centurion, 0154')
 
+    # Building our "Quick Recommender" page: all algorithms run in the
+    # background and each one's results are shown as soon as they are ready
+    if page_selection == "Quick Recommender":
+        st.title("Quick Recommender")
+        st.write("Get recommendations from all our algorithms at once.")
+        st.write('### Enter Your Three Favorite Movies')
+        fav_movies = [st.selectbox(label, title_list[start:stop],
+                                   key='quick_' + label)
+                      for label, (start, stop) in zip(
+                          ('First Option', 'Second Option', 'Third Option'),
+                          SELECTBOX_RANGES)]
+        if st.button("Recommend", key='quick_recommend'):
+            models = {'Content Based Filtering': content_model,
+                      'Collaborative Based Filtering': collab_model,
+                      'Hybrid Filtering': hybrid_model}
+            futures = background.submit(models, fav_movies, top_n=10)
+            placeholders = {label: st.empty() for label in models}
+            for label, placeholder in placeholders.items():
+                placeholder.info(label + ': crunching the numbers...')
+            for label, top_recommendations, error in background.as_ready(
+                    futures):
+                with placeholders[label].container():
+                    st.subheader(label)
+                    if isinstance(error, TimeoutError):
+                        st.warning("This is taking longer than usual. "
+                                   "Please try again in a moment.")
+                    elif error is not None:
+                        st.error("Oops! Looks like this algorithm does't "
+                                 "work. We'll need to fix it!")
+                    else:
+                        for i, j in enumerate(top_recommendations):
+                            st.write(str(i+1)+'. '+j)
+
+    # Building our "Diagnostics" page
+    if page_selection == "Diagnostics":
+        st.title("Diagnostics")
+        if not INSTRUMENTATION_ENABLED:
+            st.info("Instrumentation is disabled "
+                    "(RECOMMENDER_INSTRUMENTATION=0).")
+        st.subheader("Stage timings")
+        stage_timings = pd.DataFrame(timings())
+        if stage_timings.empty:
+            st.write("No recommendations have been made in this process yet.")
+        else:
+            st.dataframe(stage_timings.round(3))
+        st.subheader("Counters")
+        st.json(counters())
+        st.subheader("Result cache")
+        st.json(recommendation_cache.stats())
+        st.subheader("Loaded resources")
+        st.write(", ".join(registry.loaded()) or "None")
+        if st.button("Reset statistics"):
+            reset()
+
+        st.subheader("Profile a request")
+        profile_algorithm = st.radio("Algorithm",
+                                     ('Content Based Filtering',
+                                      'Collaborative Based Filtering'))
+        profile_movies = st.multiselect("Movies", title_list,
+                                        default=title_list[14930:14933])
+        if st.button("Profile") and profile_movies:
+            model = (content_model
+                     if profile_algorithm == 'Content Based Filtering'
+                     else collab_model)
+            # Bypassing the result cache so the full pipeline is profiled
+            top_recommendations, report = profile_call(model.__wrapped__,
+                                                       profile_movies,
+                                                       top_n=10)
+            for i, j in enumerate(top_recommendations):
+                st.write(str(i+1)+'. '+j)
+            st.code(report)
+
 
         
 if __name__ == '__main__':
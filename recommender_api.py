@@ -0,0 +1,345 @@
+"""
+
+    Headless HTTP service for the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Exposes `content_model` and `collab_model` as JSON
+    endpoints, without Streamlit:
+
+        POST /recommend/content        {"movies": [...], "top_n": 10}
+        POST /recommend/collaborative  {"movies": [...], "top_n": 10}
+        GET  /health
+        GET  /stats
+
+    Both recommend endpoints answer with {"recommendations": [...]}, and
+    /stats with the stage timings and counters of the server and of its
+    workers. Request bodies are limited to `MAX_BODY_BYTES`. The
+    server runs on an asyncio event loop and only uses the standard
+    library. Concurrent requests for the same algorithm and `top_n` are
+    micro-batched: they are collected for at most `--max-delay`
+    milliseconds, or until `--max-batch` requests are waiting, and then
+    scored together by `content_model_batch` / `collab_model_batch` in a
+    pool of worker processes, so the event loop is never blocked by
+    scoring. Each worker loads the data and models once when it starts,
+    or with `--shared-dir` memory-maps a single copy published by the
+    server process.
+    Run it from the root of the repository:
+
+        python recommender_api.py --port 8000 --workers 4
+
+"""
+# Script dependencies
+import argparse
+import asyncio
+import concurrent.futures
+import importlib
+import json
+import time
+
+from utils import registry
+from utils.instrumentation import (counters, drain, incr, merge, record,
+                                   reset, timings)
+from utils.shared_arrays import attach_published, publish
+
+# Batch entry points per algorithm: (module, function)
+BATCH_MODELS = {'content': ('recommenders.content_based',
+                            'content_model_batch'),
+                'collaborative': ('recommenders.collaborative_based',
+                                  'collab_model_batch')}
+
+# Resources loaded by each worker before it takes requests
+WARM_RESOURCES = {'content': ('movie_index', 'content_index',
+                              'genre_index'),
+                  'collaborative': ('movie_index', 'ratings_index',
+                                    'svd_factors', 'svd_index')}
+
+MAX_TOP_N = 100
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 64 * 1024
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large',
+               422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+def warm_worker(algorithms, shared_dir=None):
+    """Import the recommenders and load their resources in a worker."""
+    if shared_dir is not None:
+        attach_published(shared_dir)
+    for algorithm in algorithms:
+        importlib.import_module(BATCH_MODELS[algorithm][0])
+        for name in WARM_RESOURCES[algorithm]:
+            registry.get(name)
+
+def start_worker(algorithms, shared_dir=None):
+    """Initialise a worker process of the pool.
+
+    A forked worker inherits the timings and counters of the server, which
+    it would otherwise hand back with its first batch, so they are cleared
+    before warming up.
+
+    """
+    reset()
+    warm_worker(algorithms, shared_dir)
+
+def score_batch(algorithm, movie_lists, top_n):
+    """Score a batch of requests, isolating requests with unknown titles.
+
+    Runs in a worker process.
+
+    Returns
+    -------
+    tuple
+        Per request, either {'recommendations': [...]} or {'error': str},
+        and the timings and counters of the worker since its last batch
+        (see `utils.instrumentation.drain`), for the server to merge.
+
+    """
+    module, name = BATCH_MODELS[algorithm]
+    batch_model = getattr(importlib.import_module(module), name)
+    title_rows = registry.get('movie_index').title_rows
+    results = [None] * len(movie_lists)
+    valid = []
+    for i, movie_list in enumerate(movie_lists):
+        unknown = [title for title in movie_list if title not in title_rows]
+        if unknown:
+            results[i] = {'error': 'Unknown movie titles: '
+                                   + ', '.join(unknown)}
+        else:
+            valid.append(i)
+    if valid:
+        recommendations = batch_model([movie_lists[i] for i in valid], top_n)
+        for i, titles in zip(valid, recommendations):
+            results[i] = {'recommendations': titles}
+    return results, drain()
+
+class MicroBatcher:
+    """Collects concurrent requests of one algorithm into batches.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `BATCH_MODELS`.
+    executor : concurrent.futures.Executor
+        Pool the batches are scored in.
+    max_batch : int
+        Largest number of requests scored in one call.
+    max_delay : float
+        Longest time, in seconds, a request waits for others to join its
+        batch.
+
+    """
+
+    def __init__(self, algorithm, executor, max_batch=32, max_delay=0.005):
+        self.algorithm = algorithm
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # top_n -> [(movie_list, future)], and the timer flushing it
+        self._pending = {}
+        self._timers = {}
+
+    async def submit(self, movie_list, top_n):
+        """Queue a request and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(top_n, [])
+        pending.append((movie_list, future))
+        if len(pending) >= self.max_batch:
+            self._flush(top_n)
+        elif top_n not in self._timers:
+            self._timers[top_n] = loop.call_later(self.max_delay,
+                                                  self._flush, top_n)
+        return await future
+
+    def _flush(self, top_n):
+        timer = self._timers.pop(top_n, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(top_n, [])
+        if not batch:
+            return
+        incr(f'api.{self.algorithm}.batches')
+        incr(f'api.{self.algorithm}.batched_requests', len(batch))
+        movie_lists = [movie_list for movie_list, _ in batch]
+        futures = [future for _, future in batch]
+        start = time.perf_counter()
+        scored = asyncio.get_running_loop().run_in_executor(
+            self.executor, score_batch, self.algorithm, movie_lists, top_n)
+        scored.add_done_callback(
+            lambda done: self._resolve(done, futures, start))
+
+    def _resolve(self, done, futures, start):
+        record(f'api.{self.algorithm}.batch', time.perf_counter() - start)
+        if done.exception() is None:
+            results, worker_stats = done.result()
+            # Scoring stages are timed in the workers
+            merge(worker_stats)
+        for i, future in enumerate(futures):
+            if future.cancelled():
+                continue
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(results[i])
+
+class RecommenderService:
+    """HTTP/1.1 front end routing JSON requests to the batchers."""
+
+    def __init__(self, executor, max_batch=32, max_delay=0.005):
+        self.batchers = {algorithm: MicroBatcher(algorithm, executor,
+                                                 max_batch, max_delay)
+                         for algorithm in BATCH_MODELS}
+
+    async def handle(self, method, path, body):
+        """Answer one request.
+
+        Returns
+        -------
+        tuple
+            HTTP status code and JSON-serialisable payload.
+
+        """
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/stats':
+            return 200, {'timings': timings(), 'counters': counters()}
+        if not path.startswith('/recommend/'):
+            return 404, {'error': 'Not found'}
+        batcher = self.batchers.get(path[len('/recommend/'):])
+        if batcher is None:
+            return 404, {'error': 'Unknown algorithm'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            request = json.loads(body or b'{}')
+            movie_list = request['movies']
+            top_n = int(request.get('top_n', 10))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return 400, {'error': 'Expected {"movies": [...], "top_n": int}'}
+        if (not isinstance(movie_list, list) or not movie_list
+                or not all(isinstance(title, str) for title in movie_list)
+                or not 0 < top_n <= MAX_TOP_N):
+            return 400, {'error': 'movies must be a non-empty list of titles '
+                                  f'and top_n between 1 and {MAX_TOP_N}'}
+        incr('api.requests')
+        result = await batcher.submit(movie_list, top_n)
+        return (422 if 'error' in result else 200), result
+
+    async def respond(self, writer, status, payload, keep_alive):
+        """Write one JSON response."""
+        data = json.dumps(payload).encode('utf-8')
+        writer.write(
+            (f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+             'Content-Type: application/json\r\n'
+             f'Content-Length: {len(data)}\r\n'
+             f'Connection: {"keep-alive" if keep_alive else "close"}'
+             '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+    async def serve_connection(self, reader, writer):
+        """Serve the requests of one (possibly keep-alive) connection."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                # The body of a rejected request is left unread, so the
+                # connection is closed after answering
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {
+                        'error': f'Body exceeds {MAX_BODY_BYTES} bytes'},
+                        False)
+                    break
+                if length < 0:
+                    await self.respond(writer, 400, {
+                        'error': 'Invalid Content-Length'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = await self.handle(
+                        method, target.split('?', 1)[0], body)
+                except Exception as error:
+                    status, payload = 500, {'error': repr(error)}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def make_executor(workers, algorithms=tuple(BATCH_MODELS), shared_dir=None):
+    """Create the pool the batches are scored in.
+
+    With `workers=0` a single thread of this process is used instead of
+    worker processes, which is handy for debugging. With a `shared_dir`,
+    this process publishes the numeric data and models there and the
+    workers memory-map them, rather than each loading its own copy (see
+    `utils.shared_arrays`).
+
+    """
+    if workers == 0:
+        warm_worker(algorithms)
+        return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    if shared_dir is not None:
+        shared_dir = publish(shared_dir)
+        # Only the workers need the resources from now on
+        registry.clear()
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=start_worker,
+        initargs=(algorithms, shared_dir))
+
+async def serve(host, port, workers, max_batch, max_delay, shared_dir=None):
+    """Run the service until it is cancelled."""
+    executor = make_executor(workers, shared_dir=shared_dir)
+    service = RecommenderService(executor, max_batch, max_delay)
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print(f'Serving recommendations on http://{host}:{port}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Worker processes scoring batches; 0 scores '
+                             'them in a thread of the server process.')
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--max-delay', type=float, default=5.0,
+                        help='Longest wait for a batch to fill, in ms.')
+    parser.add_argument('--shared-dir', default=None,
+                        help='Publish the data and models to this folder '
+                             '(e.g. under /dev/shm) for the workers to '
+                             'share.')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers,
+                          args.max_batch, args.max_delay / 1000,
+                          args.shared_dir))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+
+    Approximate nearest-neighbour search over latent item factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: A random-projection LSH index built in pure NumPy. Each
+    of `n_tables` hash tables assigns an item the sign pattern of its
+    vector against `n_bits` random hyperplanes, so that vectors with a
+    small angle between them tend to share a bucket. A query only scores
+    the items in its own buckets (and, with `n_probes`, the buckets one
+    bit away), and reranks them exactly by cosine similarity.
+
+    More tables and probes raise recall@k at the cost of latency; more
+    bits shrink the buckets. Use `recall_at_k` to measure the trade-off
+    against `exact_search` for a given catalogue.
+
+"""
+# Script dependencies
+from collections import namedtuple
+import numpy as np
+
+from utils.ranking import top_k_indices
+
+LSHIndex = namedtuple('LSHIndex', ['vectors', 'planes', 'codes', 'order',
+                                   'n_probes'])
+
+def normalise_vectors(vectors):
+    """L2-normalise the rows of a matrix into a contiguous float32 array.
+
+    Rows with a zero norm are left as zeros.
+
+    """
+    vectors = np.array(vectors, dtype=np.float32, order='C')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+def _hash(vectors, planes):
+    """Hash vectors to one integer bucket code per table."""
+    # (n_tables x n_vectors x n_bits) sign bits, packed into int64 codes
+    bits = np.einsum('tbd,nd->tnb', planes, vectors) > 0
+    weights = np.left_shift(1, np.arange(planes.shape[1], dtype=np.int64))
+    return bits.astype(np.int64) @ weights
+
+def build_lsh_index(vectors, n_tables=16, n_bits=8, n_probes=4, seed=42):
+    """Build a random-projection LSH index.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        (n_items x n_factors) L2-normalised item vectors.
+    n_tables : int
+        Number of independent hash tables.
+    n_bits : int
+        Hyperplanes (bits) per table, at most 62.
+    n_probes : int
+        Buckets probed per table at query time: the query's own bucket
+        plus up to `n_probes - 1` buckets one bit flip away, choosing the
+        bits whose hyperplanes lie closest to the query first.
+    seed : int
+        Seed of the random hyperplanes.
+
+    Returns
+    -------
+    LSHIndex
+        The index. `vectors` is stored by reference, not copied.
+
+    """
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((n_tables, n_bits, vectors.shape[1]))
+    planes = planes.astype(np.float32)
+    codes = _hash(vectors, planes)
+    order = np.argsort(codes, axis=1, kind='stable')
+    sorted_codes = np.take_along_axis(codes, order, axis=1)
+    return LSHIndex(vectors=vectors, planes=planes, codes=sorted_codes,
+                    order=order, n_probes=n_probes)
+
+def candidates(index, query):
+    """Collect the rows sharing a probed bucket with the query.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted, unique row positions of the candidate items.
+
+    """
+    projections = np.einsum('tbd,d->tb', index.planes, query)
+    codes = _hash(query[None, :], index.planes)[:, 0]
+    found = []
+    for t in range(index.planes.shape[0]):
+        # Flip the bits the query is least certain about
+        flips = np.argsort(np.abs(projections[t]))[:index.n_probes - 1]
+        probes = np.concatenate([[codes[t]],
+                                 codes[t] ^ np.left_shift(1, flips)])
+        lo = np.searchsorted(index.codes[t], probes, side='left')
+        hi = np.searchsorted(index.codes[t], probes, side='right')
+        found.extend(index.order[t, l:h] for l, h in zip(lo, hi))
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(found))
+
+def query_lsh_index(index, query, k, exclude=None):
+    """Find approximately the k most similar items to a query vector.
+
+    Parameters
+    ----------
+    index : LSHIndex
+        Index built with `build_lsh_index`.
+    query : numpy.ndarray
+        L2-normalised query vector.
+    k : int
+        Number of neighbours to return.
+    exclude : array-like of int, optional
+        Rows which may not be returned.
+
+    Returns
+    -------
+    numpy.ndarray
+        Row positions of up to k neighbours, most similar first.
+
+    """
+    rows = candidates(index, query)
+    if exclude is not None:
+        rows = rows[~np.isin(rows, exclude)]
+    scores = index.vectors[rows] @ query
+    return rows[top_k_indices(scores, k)]
+
+def exact_search(vectors, query, k, exclude=None):
+    """Find the k most similar items to a query vector by brute force."""
+    return top_k_indices(vectors @ query, k, exclude=exclude)
+
+def recall_at_k(index, queries, k):
+    """Measure the recall@k of an LSH index against exact search.
+
+    Parameters
+    ----------
+    index : LSHIndex
+        Index to evaluate.
+    queries : numpy.ndarray
+        (n_queries x n_factors) L2-normalised query vectors.
+    k : int
+        Number of neighbours retrieved per query.
+
+    Returns
+    -------
+    float
+        Mean fraction of the exact top-k neighbours that the index found.
+
+    """
+    hits = 0
+    for query in queries:
+        exact = exact_search(index.vectors, query, k)
+        approx = query_lsh_index(index, query, k)
+        hits += np.intersect1d(exact, approx).size
+    return hits / float(len(queries) * k)
@@ -28,31 +28,90 @@
 """
 
 # Script dependencies
-import pandas as pd
 import numpy as np
-import scipy as sp
-import pickle
-import copy
 import scipy
 import scipy.sparse
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-import pathlib
 
-# Importing data
-movies_df = pd.read_csv('./resources/data/movies.csv',sep = ',')
-ratings_df = pd.read_csv('./resources/data/ratings.csv')
+from recommenders.ann_index import (build_lsh_index, normalise_vectors,
+                                    query_lsh_index)
+from recommenders.svd_factors import (build_svd_index,
+                                      current_factors_path,
+                                      extract_factors, item_rows,
+                                      load_factors, predict_matrix,
+                                      top_users)
+from utils import registry
+from utils.genre_index import genre_candidates
+from utils.instrumentation import stage
+from utils.movie_index import (movie_ids_for_titles, rows_for_titles,
+                               titles_for_movie_ids)
+from utils.ranking import top_k_indices
+from utils.result_cache import (cached_batch_recommendations,
+                                cached_recommendations)
+
+# Largest number of genre candidates (see `utils.genre_index`) allowed per
+# request. None lets every movie rated by the top users be recommended;
+# a number also limits them to movies sharing a genre with the chosen ones.
+CANDIDATE_CAP = None
 
-#Dropping "timestamp" from ratings dataset
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
+# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
+def load_svd_factors():
+    """Load the factors of the SVD model.
 
-#Merging rating_df and movies
-ratings = ratings_df.merge(movies_df[['movieId', 'title']], on='movieId')
+    The published artifact version (see `resources/models/train_colbased.py`
+    and `resources/models/update_colbased.py`) is memory-mapped when
+    present. Otherwise the factors are extracted from the pickled
+    surprise model.
 
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('./resources/models/best_svd_model.pkl', 'rb'))
+    Raises
+    ------
+    ValueError
+        If there is no artifact and the pickled model is not fitted,
+        i.e. `train_colbased.py` has not been run yet.
+
+    Returns
+    -------
+    SVDFactors
+        User and item factors, biases and ID maps of the SVD model.
+
+    """
+    path = current_factors_path(registry.SVD_FACTORS_PATH)
+    if path is not None:
+        return load_factors(path)
+    model = registry.get('svd_model')
+    if not hasattr(model, 'pu'):
+        raise ValueError(
+            f"The SVD model in {registry.SVD_MODEL_PATH} has not been "
+            "fitted. Train it first with: python "
+            "resources/models/train_colbased.py")
+    return extract_factors(model)
+
+# The latent factors are loaded once, on first use.
+registry.register('svd_factors', load_svd_factors)
+
+def svd_factors():
+    """Return the factors of the SVD model, extracting them on first use.
+
+    Returns
+    -------
+    SVDFactors
+        User and item factors, biases and ID maps of the SVD model.
+
+    """
+    return registry.get('svd_factors')
+
+# ID maps of the SVD factors, built once instead of on every request
+registry.register('svd_index', lambda: build_svd_index(svd_factors()))
+
+def svd_index():
+    """Return the user and movie ID maps of the SVD factors.
+
+    Returns
+    -------
+    SVDIndex
+        See `recommenders.svd_factors.build_svd_index`.
+
+    """
+    return registry.get('svd_index')
 
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
@@ -65,19 +124,14 @@ def prediction_item(item_id):
 
     Returns
     -------
-    list
-        User IDs of users with similar high ratings for the given movie.
+    numpy.ndarray
+        Estimated rating of the movie by every user known to the model,
+        in the user order of `svd_factors().user_ids`.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    factors = svd_factors()
+    rows = item_rows(factors, [item_id], svd_index())
+    return predict_matrix(factors, rows)[:, 0]
 
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
@@ -86,7 +140,8 @@ def pred_movies(movie_list):
     Parameters
     ----------
     movie_list : list
-        Three favourite movies selected by the app user.
+        MovieLens Movie IDs of the three favourite movies selected by the
+        app user.
 
     Returns
     -------
@@ -94,21 +149,94 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
-    # Return a list of user id's
-    return id_store
+    factors = svd_factors()
+    # Estimate the rating of every user for every movie in one product
+    estimates = predict_matrix(factors,
+                               item_rows(factors, movie_list, svd_index()))
+    # Take the top 10 user id's from each movie with highest rankings
+    top = top_users(estimates, 10)
+    return factors.user_ids[top.T.ravel()].tolist()
+
+def genre_columns(rows, cap=None):
+    """Find the rated movies sharing a genre with the chosen ones.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Catalogue rows of the chosen movies.
+    cap : int, optional
+        Largest number of genre candidates. Defaults to `CANDIDATE_CAP`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted columns of the candidates in the rating matrix.
+
+    """
+    movie_index = registry.get('movie_index')
+    candidates = genre_candidates(registry.get('genre_index'), rows,
+                                  cap=CANDIDATE_CAP if cap is None else cap)
+    cols = registry.get('ratings_index').item_ids.get_indexer(
+        movie_index.movie_ids[candidates])
+    return np.unique(cols[cols >= 0])
+
+def item_index():
+    """Return the LSH index over the item factors, building it on first use.
+
+    Returns
+    -------
+    LSHIndex
+        Index over the L2-normalised rows of the SVD item factors `qi`.
+
+    """
+    return registry.get('item_index')
+
+# LSH index over the normalised item factors, built once on first use
+registry.register('item_index', lambda: build_lsh_index(
+    normalise_vectors(svd_factors().qi)))
+
+@cached_recommendations('collaborative_ann')
+def collab_ann_model(movie_list,top_n=10):
+    """Recommends the movies closest to the chosen ones in the latent
+       factor space of the SVD model.
+
+    Unlike `collab_model`, no user-item matrix is built per request: the
+    chosen movies' normalised factors are averaged into a single query
+    which is answered by the approximate nearest-neighbour index.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    movie_index = registry.get('movie_index')
+    factors = svd_factors()
+    index = item_index()
+    with stage('collab_ann.lookup'):
+        movie_ids = movie_ids_for_titles(movie_index, movie_list)
+        rows = item_rows(factors, movie_ids, svd_index())
+        rows = rows[rows >= 0]
+    if rows.size == 0:
+        return []
+    with stage('collab_ann.search'):
+        query = normalise_vectors(index.vectors[rows].sum(axis=0,
+                                                          keepdims=True))[0]
+        top_rows = query_lsh_index(index, query, top_n, exclude=rows)
+    # Get titles of recommended movies
+    with stage('collab_ann.titles'):
+        return titles_for_movie_ids(movie_index, factors.item_ids[top_rows])
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommendations('collaborative')
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -126,78 +254,167 @@ def collab_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    top_n = 10
-    new_df = movies_df.copy()
-    new_df.set_index('movieId',inplace= True)
-
-    indices = pd.Series(movies_df['title'])
-    user_ids = pred_movies(movie_list)
-
-    #Getting movie IDs and their ratings for all top users
-    df_init_users = ratings_df[ratings_df['userId']==movie_ids[0]]
-    for i in user_ids :
-        df_init_users=df_init_users.append(ratings_df[ratings_df['userId']==i])
-    
-    #Including predictions for chosen movies
-    for j in movie_list:
-        a= pd.DataFrame(prediction_item(j))
-    for i in set(df_init_users['userId']):
-        mid = indices[indices == j].index[0]
-        est = a['est'][a['uid']==i].values[0]
-        df_init_users = df_init_users.append(pd.Series([int(i),int(mid),est], index=['userId','movieId','rating']), ignore_index=True)
-
-    # Removing duplicate entries
-    df_init_users.drop_duplicates(inplace=True)  
-
-    # Creating pivot tables
-    util_matrix = df_init_users.pivot_table(index=['userId'], columns=['movieId'], values='rating')
-
-    # Filling Nan values with 0's and save the utility matrix in scipy's sparse matrix format
-    util_matrix.fillna(0, inplace=True)
-    util_matrix_sparse = sp.sparse.csr_matrix(util_matrix.values)
-
-    # Computing the similarity matrix using cosine similarity matrix
-    user_similarity = cosine_similarity(util_matrix_sparse.T)
-
-    # Saving the matrix as a df for easier indexing
-    user_sim_df = pd.DataFrame(user_similarity, index= util_matrix.columns, columns = util_matrix.columns)
-    user_similarity = cosine_similarity(np.array(df_init_users), np.array(df_init_users))
-    user_sim_df = pd.DataFrame(user_similarity, index = df_init_users['movieId'].values.astype(int), columns = df_init_users['movieId'].values.astype(int))
-
-    # Removing duplicates rows from matrix
-    user_sim_df = user_sim_df.loc[~user_sim_df.index.duplicated(keep='first')]
-
-    # Transpose matrix
-    user_sim_df = user_sim_df.T
-    
-    # Finding movieId of chosen movie titles
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = user_sim_df[idx_1]
-    rank_2 = user_sim_df[idx_2]
-    rank_3 = user_sim_df[idx_3]
-    # Calculating the scores
-    sim_score_1 = pd.Series(rank_1).sort_values(ascending = False)
-    sim_score_2= pd.Series(rank_2).sort_values(ascending = False)
-    sim_score_3 = pd.Series(rank_3).sort_values(ascending = False)
-
-     # Appending the names of movies
-    sim_score_list = sim_score_1.append(sim_score_2).append(sim_score_3).sort_values(ascending = False)
-
-    # Choose top 50
-    top_50_indexes = list(sim_score_list.iloc[1:50].index)
-
-    # Removing chosen movies
-    indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-
-     # Get titles of recommended movies
-    recommended_movies = []
-    for i in indexes[:top_n]:
-        recommended_movies.append(list(movies_df[movies_df['movieId']==i]['title']))
-
-    # Returning a list of movies
-    recommended_movies = [val for sublist in recommended_movies for val in sublist]
+    movie_index = registry.get('movie_index')
+    # Sparse utility matrix and its userId/movieId maps, built once per
+    # process by streaming over the ratings
+    ratings_index = registry.get('ratings_index')
+    rating_matrix = ratings_index.matrix
+    user_index = ratings_index.user_ids
+    column_index = ratings_index.item_ids
+    factors = svd_factors()
+    factor_index = svd_index()
+    with stage('collab.lookup'):
+        rows = rows_for_titles(movie_index, movie_list)
+        movie_ids = movie_index.movie_ids[rows]
+    with stage('collab.top_users'):
+        # Estimated rating of every user for the chosen movies, computed
+        # once for both the top users and the fallback ratings below
+        estimates = predict_matrix(
+            factors, item_rows(factors, movie_ids, factor_index))
+        user_ids = factors.user_ids[top_users(estimates, 10).T.ravel()]
+
+    with stage('collab.user_ratings'):
+        # Selecting the rated movies of the top users from the utility matrix
+        users = np.unique(user_ids)
+        users = users[user_index.get_indexer(users) >= 0]
+        user_ratings = rating_matrix[user_index.get_indexer(users)]
+
+        # Ratings of the chosen movies by the top users. Where a user has not
+        # rated a chosen movie, the SVD estimate is used instead.
+        chosen = estimates[factor_index.users.get_indexer(users)]
+        chosen_cols = column_index.get_indexer(movie_ids)
+        for k, col in enumerate(chosen_cols):
+            if col >= 0:
+                rated = user_ratings[:, col].toarray().ravel()
+                chosen[:, k] = np.where(rated > 0, rated, chosen[:, k])
+
+    with stage('collab.candidates'):
+        # Only the movies rated by the top users can score above zero
+        candidate_cols = np.unique(user_ratings.indices)
+        if CANDIDATE_CAP is not None:
+            candidate_cols = np.intersect1d(candidate_cols,
+                                            genre_columns(rows),
+                                            assume_unique=True)
+        user_ratings = user_ratings[:, candidate_cols]
+
+    with stage('collab.similarity'):
+        # Cosine similarity of every candidate to the chosen ones over the
+        # top users, as a sparse mat-vec product
+        dots = user_ratings.T @ chosen
+        item_norms = np.sqrt(np.asarray(user_ratings.multiply(user_ratings)
+                                        .sum(axis=0)).ravel())
+        chosen_norms = np.linalg.norm(chosen, axis=0)
+        denom = item_norms[:, None] * chosen_norms[None, :]
+        sims = np.divide(dots, denom, out=np.zeros_like(dots),
+                         where=denom > 0)
+        scores = sims.sum(axis=1)
+
+        # Removing chosen movies and selecting the top-n
+        excluded = np.flatnonzero(np.isin(candidate_cols, chosen_cols))
+        top = top_k_indices(scores, top_n, exclude=excluded)
+        top_cols = candidate_cols[top[scores[top] > 0]]
+
+    # Get titles of recommended movies
+    with stage('collab.titles'):
+        recommended_movies = titles_for_movie_ids(movie_index,
+                                                  column_index[top_cols])
     return recommended_movies
+
+@cached_batch_recommendations('collaborative')
+def collab_model_batch(movie_lists, top_n=10):
+    """Performs Collaborative filtering for several requests in one call.
+
+    Gives the same recommendations as calling `collab_model` on each list
+    of movies. The SVD estimates of all chosen movies, the union of their
+    top users' ratings and the cosine similarities of every request are
+    each computed with a single matrix product. Used by the HTTP service
+    in `recommender_api.py` to answer concurrent requests.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies chosen in each request.
+    top_n : int
+        Number of top recommendations to return per request.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations of each request.
+
+    """
+    movie_index = registry.get('movie_index')
+    ratings_index = registry.get('ratings_index')
+    rating_matrix = ratings_index.matrix
+    user_index = ratings_index.user_ids
+    column_index = ratings_index.item_ids
+    factors = svd_factors()
+    factor_index = svd_index()
+    n_requests = len(movie_lists)
+    with stage('collab.lookup'):
+        rows = [rows_for_titles(movie_index, movie_list)
+                for movie_list in movie_lists]
+        # Request of each chosen movie
+        owner = np.repeat(np.arange(n_requests), [len(r) for r in rows])
+        movie_ids = movie_index.movie_ids[np.concatenate(rows)]
+    with stage('collab.top_users'):
+        estimates = predict_matrix(
+            factors, item_rows(factors, movie_ids, factor_index))
+        top = top_users(estimates, 10)
+
+    with stage('collab.user_ratings'):
+        # Distinct (request, user) pairs over the top users of each movie
+        user_rows = user_index.get_indexer(factors.user_ids[top.ravel()])
+        pair_requests = np.broadcast_to(owner, top.shape).ravel()
+        known = user_rows >= 0
+        pairs = np.unique(np.stack([pair_requests[known], user_rows[known]]),
+                          axis=1)
+        users, member = np.unique(pairs[1], return_inverse=True)
+        user_ratings = rating_matrix[users]
+        # (n_users x n_requests) indicator of the users of each request
+        membership = scipy.sparse.csr_matrix(
+            (np.ones(member.size, dtype=np.float32), (member, pairs[0])),
+            shape=(users.size, n_requests))
+
+        # Ratings of the chosen movies by the top users, falling back to
+        # the SVD estimate, and zero for users of other requests
+        chosen = estimates[factor_index.users.get_indexer(
+            user_index[users])]
+        chosen_cols = column_index.get_indexer(movie_ids)
+        rated_cols = np.flatnonzero(chosen_cols >= 0)
+        if rated_cols.size:
+            rated = user_ratings[:, chosen_cols[rated_cols]].toarray()
+            chosen[:, rated_cols] = np.where(rated > 0, rated,
+                                             chosen[:, rated_cols])
+        chosen *= membership.toarray()[:, owner]
+
+    with stage('collab.candidates'):
+        # Only the movies rated by the top users can score above zero
+        candidate_cols = np.unique(user_ratings.indices)
+        user_ratings = user_ratings[:, candidate_cols]
+
+    with stage('collab.similarity'):
+        dots = user_ratings.T @ chosen
+        # Norm of every movie over the users of each request
+        item_norms = np.sqrt((user_ratings.multiply(user_ratings).T
+                              @ membership).toarray())
+        chosen_norms = np.linalg.norm(chosen, axis=0)
+        denom = item_norms[:, owner] * chosen_norms[None, :]
+        sims = np.divide(dots, denom, out=np.zeros_like(dots),
+                         where=denom > 0)
+        # Summing the similarities of the movies of each request
+        scores = sims @ np.eye(n_requests, dtype=sims.dtype)[owner]
+
+        top_cols = []
+        for r in range(n_requests):
+            if CANDIDATE_CAP is not None:
+                outside = ~np.isin(candidate_cols, genre_columns(rows[r]))
+                scores[outside, r] = 0
+            excluded = np.flatnonzero(np.isin(candidate_cols,
+                                              chosen_cols[owner == r]))
+            top = top_k_indices(scores[:, r], top_n, exclude=excluded)
+            top_cols.append(candidate_cols[top[scores[top, r] > 0]])
+
+    with stage('collab.titles'):
+        return [titles_for_movie_ids(movie_index, column_index[cols])
+                for cols in top_cols]
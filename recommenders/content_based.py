@@ -1,112 +1,340 @@
-"""
-
-    Content-based filtering for item recommendation.
-
-    Author: Explore Data Science Academy.
-
-    Note:
-    ---------------------------------------------------------------------
-    Please follow the instructions provided within the README.md file
-    located within the root of this repository for guidance on how to use
-    this script correctly.
-
-    NB: You are required to extend this baseline algorithm to enable more
-    efficient and accurate computation of recommendations.
-
-    !! You must not change the name and signature (arguments) of the
-    prediction function, `content_model` !!
-
-    You must however change its contents (i.e. add your own content-based
-    filtering algorithm), as well as altering/adding any other functions
-    as part of your improvement.
-
-    ---------------------------------------------------------------------
-
-    Description: Provided within this file is a baseline content-based
-    filtering algorithm for rating predictions on Movie data.
-
-"""
-
-# Script dependencies
-import os
-import pandas as pd
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
-
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
-
-    Parameters
-    ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
-
-    Returns
-    -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
-
-    """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
-
-# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
-# You are, however, encouraged to change its content.  
-def content_model(movie_list,top_n=10):
-    """Performs Content filtering based upon a list of movies supplied
-       by the app user.
-
-    Parameters
-    ----------
-    movie_list : list (str)
-        Favorite movies chosen by the app user.
-    top_n : type
-        Number of top recommendations to return to the user.
-
-    Returns
-    -------
-    list (str)
-        Titles of the top-n movie recommendations to the user.
-
-    """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
+"""
+
+    Content-based filtering for item recommendation.
+
+    Author: Explore Data Science Academy.
+
+    Note:
+    ---------------------------------------------------------------------
+    Please follow the instructions provided within the README.md file
+    located within the root of this repository for guidance on how to use
+    this script correctly.
+
+    NB: You are required to extend this baseline algorithm to enable more
+    efficient and accurate computation of recommendations.
+
+    !! You must not change the name and signature (arguments) of the
+    prediction function, `content_model` !!
+
+    You must however change its contents (i.e. add your own content-based
+    filtering algorithm), as well as altering/adding any other functions
+    as part of your improvement.
+
+    ---------------------------------------------------------------------
+
+    Description: Provided within this file is a baseline content-based
+    filtering algorithm for rating predictions on Movie data.
+
+"""
+
+# Script dependencies
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from recommenders.neighbour_index import load_neighbours, neighbour_rows
+from utils import registry
+from utils.instrumentation import stage
+from utils.genre_index import chosen_genres, genre_candidates, posting_sizes
+from utils.movie_index import rows_for_titles, titles_for_rows
+from utils.ranking import top_k_indices
+from utils.result_cache import (cached_batch_recommendations,
+                                cached_recommendations)
+
+# Precomputed neighbour lists, see resources/models/train_contentbased.py
+NEIGHBOURS_PATH = registry.ROOT / 'resources' / 'models' / 'content_neighbours'
+
+# Largest number of candidate movies scored per request (see
+# `utils.genre_index`). None scores every movie sharing a genre with the
+# chosen ones, which gives the exact ranking.
+CANDIDATE_CAP = None
+
+# Take the candidates from the precomputed neighbour lists instead. They
+# are still scored exactly, but the lists are cut among tied movies, so
+# some of the best movies may never be candidates (see
+# `recommenders.neighbour_index` and `train_contentbased.py --check`).
+USE_NEIGHBOURS = False
+
+def data_preprocessing(subset_size=None):
+    """Prepare data for use within Content filtering algorithm.
+
+    Parameters
+    ----------
+    subset_size : int, optional
+        Number of movies to use within the algorithm. By default the
+        full catalogue is used.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Subset of movies selected for content-based filtering.
+
+    """
+    movies = registry.get('movies')
+    # Split genre data into individual words.
+    keywords = movies['genres'].astype(str).str.replace('|', ' ', regex=False)
+    # Subset of the data
+    movies_subset = movies.assign(keyWords=keywords)[:subset_size]
+    return movies_subset
+
+def build_similarity_index(data):
+    """Vectorise the genre keywords of every movie into a sparse matrix.
+
+    The rows are L2-normalised, so the dot product of two rows is their
+    cosine similarity. This lets a query score its own rows against the
+    catalogue without ever materialising the full N x N similarity matrix.
+
+    Parameters
+    ----------
+    data : Pandas Dataframe
+        Movies with a 'keyWords' column, as returned by `data_preprocessing`.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Row-normalised (n_movies x n_keywords) count matrix.
+
+    """
+    count_vec = CountVectorizer()
+    count_matrix = count_vec.fit_transform(data['keyWords'])
+    return normalize(count_matrix.astype(np.float32), norm='l2', copy=False).tocsr()
+
+def similarity_scores(index, rows):
+    """Compute the summed cosine similarity of the given rows to every movie.
+
+    Parameters
+    ----------
+    index : scipy.sparse.csr_matrix
+        Row-normalised count matrix from `build_similarity_index`.
+    rows : list (int)
+        Row positions of the query movies.
+
+    Returns
+    -------
+    numpy.ndarray
+        One similarity score per movie in the catalogue.
+
+    """
+    return np.asarray(similarity_rows(index, rows).sum(axis=0)).ravel()
+
+def candidate_rows(rows, top_n, cap=CANDIDATE_CAP):
+    """Return the movies to score for the given rows.
+
+    Movies sharing no genre with the chosen ones have zero similarity to
+    them, so only the movies sharing one need to be scored.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Row positions of the query movies.
+    top_n : int
+        Number of recommendations to be made.
+    cap : int, optional
+        Largest number of candidates, see `genre_candidates`.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Sorted row positions of the candidates, including `rows`. None
+        when the whole catalogue should be scored instead: when the
+        candidates cover much of it, scoring everything is cheaper than
+        gathering them, and when they leave fewer than `top_n` movies to
+        recommend.
+
+    """
+    genre_index = registry.get('genre_index')
+    n_movies = len(genre_index.row_indptr) - 1
+    if cap is None or cap * 4 > n_movies:
+        # A single genre of the chosen movies may already cover too much
+        sizes = posting_sizes(genre_index, chosen_genres(genre_index, rows))
+        if sizes.size == 0 or sizes.max() * 4 > n_movies:
+            return None
+    candidates = genre_candidates(genre_index, rows, cap=cap)
+    if candidates.size * 4 > n_movies or candidates.size - len(rows) < top_n:
+        return None
+    return candidates
+
+def request_candidates(rows, top_n, neighbours=None):
+    """Return the movies to score for a request.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Row positions of the query movies.
+    top_n : int
+        Number of recommendations to be made.
+    neighbours : dict, optional
+        Neighbour index as returned by `load_neighbours`. If given, the
+        candidates are the neighbours of the query movies rather than the
+        movies sharing a genre with them.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Sorted row positions of the candidates, including `rows`, or None
+        to score the whole catalogue.
+
+    """
+    if neighbours is None:
+        return candidate_rows(rows, top_n)
+    candidates = np.union1d(neighbour_rows(neighbours, rows), rows)
+    if candidates.size - np.unique(rows).size < top_n:
+        return None
+    return candidates
+
+def served_neighbours():
+    """Return the neighbour index if the recommenders should use it."""
+    return registry.get('content_neighbours') if USE_NEIGHBOURS else None
+
+def similarity_rows(index, rows, candidates=None):
+    """Compute the cosine similarity of each of the given rows to every movie.
+
+    Parameters
+    ----------
+    index : scipy.sparse.csr_matrix
+        Row-normalised count matrix from `build_similarity_index`.
+    rows : list (int)
+        Row positions of the query movies.
+    candidates : numpy.ndarray, optional
+        Row positions of the movies to compare them with. Defaults to
+        the whole catalogue.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (len(rows) x n_candidates) similarity matrix.
+
+    """
+    others = index if candidates is None else index[candidates]
+    # (len(rows) x n_keywords) . (n_keywords x n_movies) -> len(rows) x n_movies
+    return index[rows] @ others.T
+
+# The similarity index is built once per process, on first use
+registry.register('content_data', data_preprocessing)
+registry.register('content_index', lambda: build_similarity_index(
+    registry.get('content_data')))
+# Memory-map the precomputed neighbours if they match the movie data
+registry.register('content_neighbours', lambda: load_neighbours(
+    NEIGHBOURS_PATH, registry.get('movies')['movieId'].values))
+
+def content_rows(chosen, top_n, neighbours=None):
+    """Rank movies by their summed genre similarity to the chosen ones.
+
+    Parameters
+    ----------
+    chosen : numpy.ndarray
+        Row positions of the chosen movies.
+    top_n : int
+        Number of rows to return.
+    neighbours : dict, optional
+        Neighbour index to take the candidates from, see
+        `request_candidates`. By default the ranking is exact.
+
+    Returns
+    -------
+    numpy.ndarray
+        Row positions of the top-n movies, best first.
+
+    """
+    content_index = registry.get('content_index')
+    with stage('content.candidates'):
+        candidates = request_candidates(chosen, top_n, neighbours)
+    with stage('content.score'):
+        # Scoring the chosen rows against the candidates only
+        scores = similarity_rows(content_index, chosen, candidates)
+        scores = np.asarray(scores.sum(axis=0)).ravel()
+        # Selecting the most similar movies, excluding the chosen ones
+        if candidates is None:
+            return top_k_indices(scores, top_n, exclude=chosen)
+        excluded = np.flatnonzero(np.isin(candidates, chosen))
+        return candidates[top_k_indices(scores, top_n, exclude=excluded)]
+
+# !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
+# You are, however, encouraged to change its content.  
+@cached_recommendations('content')
+def content_model(movie_list,top_n=10):
+    """Performs Content filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    movie_index = registry.get('movie_index')
+    # Getting the index of the movies that match the titles
+    with stage('content.lookup'):
+        chosen = rows_for_titles(movie_index, movie_list[:3])
+    top_indexes = content_rows(chosen, top_n, served_neighbours())
+    with stage('content.titles'):
+        recommended_movies = titles_for_rows(movie_index, top_indexes)
+    return recommended_movies
+
+@cached_batch_recommendations('content')
+def content_model_batch(movie_lists, top_n=10):
+    """Performs Content filtering for several requests in one call.
+
+    Gives the same recommendations as calling `content_model` on each
+    list of movies, but scores all of them together. Used by the HTTP
+    service in `recommender_api.py` to answer concurrent requests.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies chosen in each request.
+    top_n : int
+        Number of top recommendations to return per request.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n movie recommendations of each request.
+
+    """
+    movie_index = registry.get('movie_index')
+    content_index = registry.get('content_index')
+    neighbours = served_neighbours()
+    with stage('content.lookup'):
+        chosen = [rows_for_titles(movie_index, movie_list[:3])
+                  for movie_list in movie_lists]
+    with stage('content.candidates'):
+        candidates = [request_candidates(c, top_n, neighbours)
+                      for c in chosen]
+        if any(c is None for c in candidates):
+            scored = None
+        else:
+            scored = np.unique(np.concatenate(candidates))
+    with stage('content.score'):
+        rows = np.concatenate(chosen)
+        owner = np.repeat(np.arange(len(chosen)), [len(c) for c in chosen])
+        # Summing the similarities of the rows of each request
+        requests = scipy.sparse.csr_matrix(
+            (np.ones(rows.size, dtype=np.float32),
+             (owner, np.arange(rows.size))),
+            shape=(len(chosen), rows.size))
+        scores = requests @ similarity_rows(content_index, rows, scored)
+        scores = scores.toarray()
+        top_indexes = []
+        for r, c in enumerate(chosen):
+            if scored is None and candidates[r] is None:
+                top_indexes.append(top_k_indices(scores[r], top_n,
+                                                 exclude=c))
+                continue
+            ids = np.arange(scores.shape[1]) if scored is None else scored
+            if candidates[r] is not None:
+                # Only the request's own candidates, as in `content_model`
+                scores[r, ~np.isin(ids, candidates[r])] = -np.inf
+            excluded = np.flatnonzero(np.isin(ids, c))
+            top_indexes.append(ids[top_k_indices(scores[r], top_n,
+                                                 exclude=excluded)])
+    with stage('content.titles'):
+        return [titles_for_rows(movie_index, top) for top in top_indexes]
@@ -0,0 +1,257 @@
+"""
+
+    Hybrid filtering for item recommendation.
+
+    Author: Explore Data Science Academy.
+
+    Description: Blends three signals over one shared array of candidate
+    movies:
+
+      - genre similarity to the chosen movies (as in `content_model`),
+      - latent-factor similarity in the SVD model's item space, and
+      - a popularity prior: the damped mean rating of each movie.
+
+    Candidates are the nearest neighbours of the chosen movies in the SVD
+    factor space plus the most popular movies. Every signal, including the
+    exact genre similarity, is then scored for all candidates at once, and
+    the scores are combined with configurable weights. The data, indexes
+    and models come from the shared registry, so nothing is reloaded or
+    rebuilt per request.
+
+"""
+# Script dependencies
+import functools
+from collections import namedtuple
+import numpy as np
+
+from recommenders.ann_index import normalise_vectors
+from recommenders.collaborative_based import svd_factors
+from recommenders.svd_factors import item_rows
+from utils import registry
+from utils.instrumentation import stage
+from utils.movie_index import rows_for_titles, titles_for_rows
+from utils.ranking import top_k_indices
+from utils.result_cache import cached_recommendations
+
+DEFAULT_WEIGHTS = {'genre': 0.4, 'latent': 0.4, 'popularity': 0.2}
+
+# Candidates drawn from each of the latent-factor neighbours and the
+# most popular movies
+CANDIDATES_PER_SOURCE = 100
+
+# Number of ratings at which a movie's own mean outweighs the global mean
+POPULARITY_DAMPING = 20
+
+# `factor_rows`, `popularity` and `genres` are indexed by catalogue row:
+# the movie's row in the SVD factors (-1 if the model does not know it),
+# its popularity prior in [0, 1] and its L2-normalised genre vector.
+# `item_vectors` holds the L2-normalised SVD item factors, and
+# `catalogue_rows` maps each SVD factor row back to its catalogue row.
+# `popular_rows` lists the catalogue rows of the most popular movies,
+# most popular first.
+HybridFeatures = namedtuple('HybridFeatures', ['factor_rows', 'popularity',
+                                               'genres', 'item_vectors',
+                                               'catalogue_rows',
+                                               'popular_rows'])
+
+def build_hybrid_features():
+    """Align the SVD factors, genres and rating statistics with the catalogue.
+
+    Returns
+    -------
+    HybridFeatures
+        Arrays shared by every hybrid request.
+
+    """
+    movie_index = registry.get('movie_index')
+    ratings_index = registry.get('ratings_index')
+    factors = svd_factors()
+    factor_rows = item_rows(factors, movie_index.movie_ids)
+    catalogue_rows = movie_index.id_rows.get_indexer(
+        factors.item_ids.astype(movie_index.id_rows.dtype))
+
+    # Damped mean rating, so that a handful of 5-star ratings does not
+    # outrank a well-liked classic
+    count = ratings_index.item_count.astype(np.float64)
+    total = count * ratings_index.item_mean
+    global_mean = total.sum() / max(count.sum(), 1)
+    damped = ((total + POPULARITY_DAMPING * global_mean)
+              / (count + POPULARITY_DAMPING))
+    low, high = factors.rating_scale
+    popularity = np.zeros(len(movie_index.movie_ids), dtype=np.float32)
+    cols = ratings_index.item_ids.get_indexer(movie_index.movie_ids)
+    rated = cols >= 0
+    popularity[rated] = (damped[cols[rated]] - low) / (high - low)
+
+    # The genre vocabulary is only a few dozen words, so a dense copy of
+    # the similarity index is small and much faster to slice
+    genres = registry.get('content_index').toarray()
+    # Enough popular movies to fill the candidates whatever is chosen
+    popular_rows = top_k_indices(popularity, CANDIDATES_PER_SOURCE + 3)
+    return HybridFeatures(factor_rows=factor_rows, popularity=popularity,
+                          genres=genres,
+                          item_vectors=normalise_vectors(factors.qi),
+                          catalogue_rows=catalogue_rows,
+                          popular_rows=popular_rows)
+
+# Built once per process, on first use
+registry.register('hybrid_features', build_hybrid_features)
+
+def blend_weights(weights=None):
+    """Complete and validate the blending weights.
+
+    Parameters
+    ----------
+    weights : dict, optional
+        Weight of some or all of 'genre', 'latent' and 'popularity'.
+        Missing signals keep their default weight.
+
+    Returns
+    -------
+    dict
+        Weight of every signal.
+
+    Raises
+    ------
+    ValueError
+        If a signal is unknown or a weight is negative.
+
+    """
+    blended = dict(DEFAULT_WEIGHTS)
+    for name, weight in (weights or {}).items():
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Unknown signal '{name}', expected one of "
+                             + ', '.join(DEFAULT_WEIGHTS))
+        if weight < 0:
+            raise ValueError(f"Weight of '{name}' must not be negative")
+        blended[name] = float(weight)
+    return blended
+
+def latent_similarity(features, rows):
+    """Compute the cosine similarity of every SVD item to the chosen movies.
+
+    The normalised factors of the chosen movies are summed into a single
+    query, as in `collab_ann_model`. The SVD model only holds a few
+    thousand items, so exact search is cheaper than probing the LSH index.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Similarity per SVD factor row, or None if the model knows none of
+        the chosen movies.
+
+    """
+    chosen = features.factor_rows[rows]
+    chosen = chosen[chosen >= 0]
+    if chosen.size == 0:
+        return None
+    vectors = features.item_vectors
+    query = normalise_vectors(vectors[chosen].sum(axis=0, keepdims=True))[0]
+    similarity = vectors @ query
+    # The chosen movies are never candidates
+    similarity[chosen] = -np.inf
+    return similarity
+
+def hybrid_candidates(features, rows, latent):
+    """Collect the shared candidate movies of a request.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted catalogue rows of the latent-factor neighbours of the
+        chosen movies and of the most popular movies, excluding the
+        chosen movies themselves.
+
+    """
+    popular = features.popular_rows
+    popular = popular[~np.isin(popular, rows)][:CANDIDATES_PER_SOURCE]
+    found = [popular]
+    if latent is not None:
+        nearest = top_k_indices(latent, CANDIDATES_PER_SOURCE)
+        catalogue = features.catalogue_rows[nearest]
+        found.append(catalogue[catalogue >= 0])
+    candidates = np.unique(np.concatenate(found))
+    return candidates[~np.isin(candidates, rows)]
+
+def hybrid_scores(features, rows, candidates, latent, weights):
+    """Score candidate movies against the chosen ones.
+
+    Parameters
+    ----------
+    features : HybridFeatures
+        Shared arrays from `build_hybrid_features`.
+    rows : numpy.ndarray
+        Catalogue rows of the chosen movies.
+    candidates : numpy.ndarray
+        Catalogue rows of the movies to score.
+    latent : numpy.ndarray or None
+        Output of `latent_similarity`.
+    weights : dict
+        Weight of every signal, as returned by `blend_weights`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Blended score of each candidate.
+
+    """
+    # Mean cosine similarity of the genres
+    genre = features.genres[candidates] @ features.genres[rows].T
+    scores = weights['genre'] * genre.mean(axis=1)
+    if latent is not None:
+        factor_rows = features.factor_rows[candidates]
+        known = factor_rows >= 0
+        # Cosine similarity rescaled to [0, 1], and 0 for unknown movies
+        similarity = latent[factor_rows[known]]
+        scores[known] += weights['latent'] * (similarity + 1) / 2
+    scores += weights['popularity'] * features.popularity[candidates]
+    return scores
+
+def _hybrid_model(movie_list, top_n, weights):
+    movie_index = registry.get('movie_index')
+    features = registry.get('hybrid_features')
+    with stage('hybrid.lookup'):
+        rows = rows_for_titles(movie_index, movie_list[:3])
+    with stage('hybrid.candidates'):
+        latent = latent_similarity(features, rows)
+        candidates = hybrid_candidates(features, rows, latent)
+    with stage('hybrid.score'):
+        scores = hybrid_scores(features, rows, candidates, latent, weights)
+        top = candidates[top_k_indices(scores, top_n)]
+    with stage('hybrid.titles'):
+        return titles_for_rows(movie_index, top)
+
+@functools.lru_cache(maxsize=None)
+def _cached_model(weight_items):
+    """Return the cached recommender for one set of weights."""
+    weights = dict(weight_items)
+    algorithm = 'hybrid'
+    if weights != DEFAULT_WEIGHTS:
+        algorithm += ':' + ','.join(f'{name}={weight:g}'
+                                    for name, weight in weight_items)
+    return cached_recommendations(algorithm)(
+        lambda movie_list, top_n=10: _hybrid_model(movie_list, top_n,
+                                                   weights))
+
+def hybrid_model(movie_list, top_n=10, weights=None):
+    """Performs Hybrid filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    weights : dict, optional
+        Weight of some or all of the 'genre', 'latent' and 'popularity'
+        signals. Defaults to `DEFAULT_WEIGHTS`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    weights = blend_weights(weights)
+    return _cached_model(tuple(sorted(weights.items())))(movie_list, top_n)
@@ -0,0 +1,132 @@
+"""
+
+    Precomputed item-neighbour index for content-based recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: The top-K most similar movies of every movie are computed
+    offline (see `resources/models/train_contentbased.py`) and stored as
+    CSR arrays: `indptr`, neighbour row `indices` (int32) and similarity
+    `data` (float32). The app memory-maps these arrays, so a request only
+    has to gather the neighbour lists of the chosen movies.
+
+    The lists are cut at K neighbours. Genre similarities are heavily
+    tied, so a list often ends among many equally similar movies, and a
+    movie similar to all of the chosen ones may be missing from all of
+    their lists. Rankings drawn from the lists are therefore only an
+    approximation of the exact ones.
+
+"""
+# Script dependencies
+import os
+import numpy as np
+
+NEIGHBOUR_ARRAYS = ('indptr', 'indices', 'data', 'movie_ids')
+
+def build_neighbours(index, k=50, block_size=256):
+    """Compute the top-k neighbours of every row of a normalised index.
+
+    Parameters
+    ----------
+    index : scipy.sparse.csr_matrix
+        Row-normalised (n_movies x n_features) matrix, so that the dot
+        product of two rows is their cosine similarity.
+    k : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of movies scored at once. Peak memory is roughly
+        4 * n_movies * block_size bytes.
+
+    Returns
+    -------
+    tuple (numpy.ndarray)
+        CSR `indptr`, `indices` and `data` arrays of the neighbour lists.
+
+    """
+    n_items = index.shape[0]
+    k = min(k, n_items - 1)
+    index_t = index.T.tocsr()
+    if index.shape[1] * n_items * 4 <= 2 ** 28:
+        # Small vocabularies (e.g. genres) are scored faster as dense BLAS
+        index_t = index_t.toarray().astype(np.float32)
+    indices = np.empty((n_items, k), dtype=np.int32)
+    data = np.empty((n_items, k), dtype=np.float32)
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        # (block x n_movies) similarities of the block to the catalogue
+        sims = index[start:stop] @ index_t
+        if not isinstance(sims, np.ndarray):
+            sims = sims.toarray()
+        sims = np.asarray(sims, dtype=np.float32)
+        # A movie is not its own neighbour
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        # Genre similarities are heavily tied, so of the movies tied with
+        # the k-th score the lowest rows are kept, as in `top_k_indices`
+        kth = -np.partition(-sims, k - 1, axis=1)[:, k - 1:k]
+        above = sims > kth
+        tied = sims == kth
+        room = k - above.sum(axis=1, keepdims=True)
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= room))
+        top = np.nonzero(keep)[1].reshape(stop - start, k)
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.lexsort((top, -top_scores), axis=-1)
+        indices[start:stop] = np.take_along_axis(top, order, axis=1)
+        data[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    indptr = np.arange(0, (n_items + 1) * k, k, dtype=np.int64)
+    return indptr, indices.ravel(), data.ravel()
+
+def save_neighbours(path, indptr, indices, data, movie_ids):
+    """Save a neighbour index as one `.npy` file per array.
+
+    Parameters
+    ----------
+    path : str
+        Directory to write the index to. It is created if needed.
+    indptr, indices, data : numpy.ndarray
+        CSR arrays as returned by `build_neighbours`.
+    movie_ids : numpy.ndarray
+        MovieLens IDs of the indexed rows, used to check that the index
+        still matches the movie data it is served with.
+
+    """
+    os.makedirs(path, exist_ok=True)
+    arrays = {'indptr': np.asarray(indptr, dtype=np.int64),
+              'indices': np.asarray(indices, dtype=np.int32),
+              'data': np.asarray(data, dtype=np.float32),
+              'movie_ids': np.asarray(movie_ids, dtype=np.int32)}
+    for name in NEIGHBOUR_ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+
+def load_neighbours(path, movie_ids=None):
+    """Memory-map a neighbour index saved with `save_neighbours`.
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the index.
+    movie_ids : array-like of int, optional
+        MovieLens IDs of the rows the app serves. If given, the index is
+        only returned when it was built for exactly these movies.
+
+    Returns
+    -------
+    dict or None
+        Read-only memory-mapped arrays keyed by name, or None if the
+        index is missing or stale.
+
+    """
+    files = [os.path.join(path, name + '.npy') for name in NEIGHBOUR_ARRAYS]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    neighbours = {name: np.load(f, mmap_mode='r')
+                  for name, f in zip(NEIGHBOUR_ARRAYS, files)}
+    if movie_ids is not None and not np.array_equal(neighbours['movie_ids'],
+                                                    np.asarray(movie_ids)):
+        return None
+    return neighbours
+
+def neighbour_rows(neighbours, rows):
+    """Return the sorted union of the neighbour lists of the given rows."""
+    indptr = neighbours['indptr']
+    return np.unique(np.concatenate(
+        [neighbours['indices'][indptr[r]:indptr[r + 1]] for r in rows]))
@@ -0,0 +1,402 @@
+"""
+
+    Vectorised scoring with the latent factors of a trained SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: The surprise `SVD.predict` method scores a single
+    (user, item) pair at a time. The helpers below pull the learnt
+    parameters out of the model once, so that the ratings of every user
+    for a batch of items are computed with a single matrix product.
+
+    The parameters can also be saved as a folder of float32/int32 `.npy`
+    files with a `manifest.json` holding the format version, the scalar
+    parameters and a SHA-256 checksum per array. The checksums are
+    verified when a version is published; serving processes then
+    memory-map the files, without unpickling (or importing) surprise.
+
+    Artifacts are published as numbered versions in a folder whose
+    `CURRENT` file names the version being served. `partial_fit` updates
+    a model with new ratings without retraining it, and `publish_factors`
+    swaps the result in atomically for the serving processes to pick up.
+
+"""
+# Script dependencies
+from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+CURRENT_FILE = 'CURRENT'
+ARTIFACT_FORMAT = 'svd-factors'
+ARTIFACT_VERSION = 1
+ARTIFACT_ARRAYS = {'pu': np.float32, 'qi': np.float32, 'bu': np.float32,
+                   'bi': np.float32, 'user_ids': np.int32,
+                   'item_ids': np.int32}
+
+# Learnt SVD parameters. Row `i` of `pu`/`bu` belongs to raw user ID
+# `user_ids[i]`, and row `j` of `qi`/`bi` to raw movie ID `item_ids[j]`.
+SVDFactors = namedtuple('SVDFactors', ['pu', 'qi', 'bu', 'bi', 'global_mean',
+                                       'user_ids', 'item_ids', 'rating_scale'])
+
+# Pandas Index objects mapping raw user and movie IDs to the rows of
+# `SVDFactors`, built once per model by `build_svd_index`
+SVDIndex = namedtuple('SVDIndex', ['users', 'items'])
+
+def extract_factors(model):
+    """Extract the latent factors and biases of a fitted surprise SVD model.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        A fitted SVD model.
+
+    Returns
+    -------
+    SVDFactors
+        The model parameters as float32/int NumPy arrays.
+
+    """
+    if not hasattr(model, 'pu'):
+        raise ValueError("The SVD model has not been fitted.")
+    trainset = model.trainset
+    user_ids = np.array([trainset.to_raw_uid(u)
+                         for u in range(trainset.n_users)])
+    item_ids = np.array([trainset.to_raw_iid(i)
+                         for i in range(trainset.n_items)])
+    return SVDFactors(pu=np.ascontiguousarray(model.pu, dtype=np.float32),
+                      qi=np.ascontiguousarray(model.qi, dtype=np.float32),
+                      bu=np.asarray(model.bu, dtype=np.float32),
+                      bi=np.asarray(model.bi, dtype=np.float32),
+                      global_mean=float(trainset.global_mean),
+                      user_ids=user_ids,
+                      item_ids=item_ids,
+                      rating_scale=tuple(trainset.rating_scale))
+
+def build_svd_index(factors):
+    """Index the user and movie IDs of SVD factors for repeated lookups.
+
+    Returns
+    -------
+    SVDIndex
+        Pandas Index objects over `factors.user_ids` and `item_ids`.
+
+    """
+    return SVDIndex(users=pd.Index(factors.user_ids),
+                    items=pd.Index(factors.item_ids))
+
+def item_rows(factors, movie_ids, index=None):
+    """Map MovieLens movie IDs to rows of the item factor matrix.
+
+    Parameters
+    ----------
+    factors : SVDFactors
+        Parameters of the trained model.
+    movie_ids : array-like of int
+        MovieLens movie IDs.
+    index : SVDIndex, optional
+        Index of `factors` from `build_svd_index`. Without it, the item
+        IDs are indexed again on every call.
+
+    Returns
+    -------
+    numpy.ndarray
+        Row of each movie in `factors.qi`, or -1 for movies unknown to
+        the model.
+
+    """
+    items = pd.Index(factors.item_ids) if index is None else index.items
+    return items.get_indexer(movie_ids)
+
+def predict_matrix(factors, items):
+    """Estimate the rating of every user for a batch of items.
+
+    Matches `surprise.SVD.estimate`: unknown items only receive the
+    global mean and user bias, and estimates are clipped to the rating
+    scale.
+
+    Parameters
+    ----------
+    factors : SVDFactors
+        Parameters of the trained model.
+    items : array-like of int
+        Rows of the items in `factors.qi`, as returned by `item_rows`.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n_users x n_items) float32 matrix of estimated ratings.
+
+    """
+    items = np.asarray(items)
+    known = items >= 0
+    qi = np.where(known[:, None], factors.qi[items], 0).astype(np.float32)
+    bi = np.where(known, factors.bi[items], 0).astype(np.float32)
+    est = factors.pu @ qi.T
+    est += factors.bu[:, None]
+    est += bi[None, :]
+    est += factors.global_mean
+    return np.clip(est, *factors.rating_scale, out=est)
+
+def top_users(estimates, n):
+    """Select the users with the highest estimated rating for each item.
+
+    Parameters
+    ----------
+    estimates : numpy.ndarray
+        (n_users x n_items) matrix as returned by `predict_matrix`.
+    n : int
+        Number of users to select per item.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n x n_items) matrix of user rows, best first in each column.
+
+    """
+    n = min(n, estimates.shape[0])
+    top = np.argpartition(-estimates, n - 1, axis=0)[:n]
+    order = np.argsort(-np.take_along_axis(estimates, top, axis=0),
+                       axis=0, kind='stable')
+    return np.take_along_axis(top, order, axis=0)
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_factors(factors, path):
+    """Save SVD factors as a memory-mappable artifact folder.
+
+    The folder is written next to its destination and renamed into
+    place, so readers never see a partially written artifact.
+
+    Parameters
+    ----------
+    factors : SVDFactors
+        Parameters to save.
+    path : str or pathlib.Path
+        Destination folder. An existing artifact there is replaced.
+
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    build = tempfile.mkdtemp(dir=parent, prefix='.svd-factors-')
+    manifest = {'format': ARTIFACT_FORMAT, 'version': ARTIFACT_VERSION,
+                'global_mean': float(factors.global_mean),
+                'rating_scale': [float(v) for v in factors.rating_scale],
+                'arrays': {}}
+    for name, dtype in ARTIFACT_ARRAYS.items():
+        array = np.ascontiguousarray(getattr(factors, name), dtype=dtype)
+        file = os.path.join(build, name + '.npy')
+        np.save(file, array)
+        manifest['arrays'][name] = {'dtype': np.dtype(dtype).str,
+                                    'shape': list(array.shape),
+                                    'sha256': _sha256(file)}
+    with open(os.path.join(build, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.chmod(build, 0o755)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(build, path)
+
+def load_factors(path, verify=False):
+    """Load SVD factors saved with `save_factors`.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Artifact folder.
+    verify : bool
+        Check the SHA-256 checksum of every array. This reads the arrays
+        in full, so it is off by default for serving.
+
+    Returns
+    -------
+    SVDFactors
+        Parameters backed by read-only memory maps.
+
+    Raises
+    ------
+    ValueError
+        If the artifact has an unknown format or version, or fails its
+        checksum.
+
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != ARTIFACT_FORMAT or \
+            manifest.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported SVD artifact in {path}: "
+                         f"{manifest.get('format')} "
+                         f"v{manifest.get('version')}.")
+    arrays = {}
+    for name, info in manifest['arrays'].items():
+        file = os.path.join(path, name + '.npy')
+        if verify and _sha256(file) != info['sha256']:
+            raise ValueError(f"Checksum mismatch for {file}.")
+        arrays[name] = np.load(file, mmap_mode='r')
+        if list(arrays[name].shape) != info['shape']:
+            raise ValueError(f"Unexpected shape for {file}.")
+    return SVDFactors(global_mean=manifest['global_mean'],
+                      rating_scale=tuple(manifest['rating_scale']),
+                      **arrays)
+
+def current_factors_path(root):
+    """Return the folder of the artifact version being served, or None.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        Folder of published versions. A plain artifact folder (holding
+        its own manifest) is also accepted.
+
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return os.path.join(root, f.read().strip())
+    except OSError:
+        pass
+    if os.path.exists(os.path.join(root, 'manifest.json')):
+        return str(root)
+    return None
+
+def publish_factors(factors, root, keep=3):
+    """Save factors as a new version and make it the one being served.
+
+    The version is fully written, and the checksums of its arrays are
+    verified, before the `CURRENT` pointer is replaced with an atomic
+    rename, so serving processes either see the previous version or the
+    new one.
+
+    Parameters
+    ----------
+    factors : SVDFactors
+        Parameters to publish.
+    root : str or pathlib.Path
+        Folder of published versions.
+    keep : int
+        Number of most recent versions kept on disk.
+
+    Returns
+    -------
+    str
+        Name of the published version.
+
+    Raises
+    ------
+    ValueError
+        If the written arrays fail their checksum. The version is then
+        removed and the served one is left unchanged.
+
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = sorted(v for v in os.listdir(root) if v.startswith('v')
+                      and v[1:].isdigit())
+    version = 'v%04d' % (int(versions[-1][1:]) + 1 if versions else 1)
+    path = os.path.join(root, version)
+    save_factors(factors, path)
+    # Serving processes skip the checksums, so they are checked here
+    try:
+        load_factors(path, verify=True)
+    except ValueError:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    fd, tmp = tempfile.mkstemp(dir=root, prefix='.current-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(version + '\n')
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    # Processes still mapping an old version keep their pages after unlink
+    for old in (versions + [version])[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+def partial_fit(factors, ratings, new_ratings, n_epochs=10, lr=0.005,
+                reg=0.02, batch_size=256, init_std_dev=0.1, seed=42):
+    """Update SVD factors with new ratings, without a full retrain.
+
+    New users and movies are appended to the ID maps with freshly
+    initialised factors. A few epochs of mini-batch SGD are then run on
+    every rating of the users and movies that appear in `new_ratings`,
+    updating only their rows of `pu`, `qi`, `bu` and `bi`; every other
+    parameter stays fixed.
+
+    Parameters
+    ----------
+    factors : SVDFactors
+        Parameters of the current model. They are not modified.
+    ratings : Pandas Dataframe
+        All ratings, including the new ones, with 'userId', 'movieId'
+        and 'rating' columns.
+    new_ratings : Pandas Dataframe
+        The ratings which were added or changed.
+    n_epochs, lr, reg : float
+        Number of passes, learning rate and regularisation of the SGD.
+    batch_size : int
+        Ratings per vectorised SGD step.
+    init_std_dev : float
+        Standard deviation of the factors of new users and movies.
+
+    Returns
+    -------
+    SVDFactors
+        The updated parameters.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_factors = factors.pu.shape[1]
+
+    def extend(ids, vectors, biases, new_ids):
+        """Append unknown IDs with random factors and zero biases."""
+        new_ids = np.setdiff1d(np.unique(new_ids), ids)
+        vectors = np.vstack([vectors, rng.normal(
+            0, init_std_dev, (len(new_ids), n_factors)).astype(np.float32)])
+        return (np.concatenate([ids, new_ids]).astype(np.int32), vectors,
+                np.concatenate([biases, np.zeros(len(new_ids), np.float32)]))
+
+    user_ids, pu, bu = extend(factors.user_ids, factors.pu, factors.bu,
+                              new_ratings['userId'].values)
+    item_ids, qi, bi = extend(factors.item_ids, factors.qi, factors.bi,
+                              new_ratings['movieId'].values)
+    user_index, item_index = pd.Index(user_ids), pd.Index(item_ids)
+
+    # Only the rows of users and movies with new ratings are trained
+    train_user = np.zeros(len(user_ids), dtype=bool)
+    train_user[user_index.get_indexer(new_ratings['userId'].values)] = True
+    train_item = np.zeros(len(item_ids), dtype=bool)
+    train_item[item_index.get_indexer(new_ratings['movieId'].values)] = True
+
+    users = user_index.get_indexer(ratings['userId'].values)
+    items = item_index.get_indexer(ratings['movieId'].values)
+    affected = (users >= 0) & (items >= 0)
+    affected &= (train_user[np.maximum(users, 0)]
+                 | train_item[np.maximum(items, 0)])
+    users, items = users[affected], items[affected]
+    values = ratings['rating'].values[affected].astype(np.float32)
+
+    mu = factors.global_mean
+    for _ in range(n_epochs):
+        order = rng.permutation(len(values))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            u, i, r = users[batch], items[batch], values[batch]
+            pu_b, qi_b = pu[u], qi[i]
+            err = r - (mu + bu[u] + bi[i] + np.einsum('ij,ij->i', pu_b, qi_b))
+            step_u = train_user[u][:, None]
+            step_i = train_item[i][:, None]
+            np.add.at(bu, u, lr * (err - reg * bu[u]) * step_u[:, 0])
+            np.add.at(bi, i, lr * (err - reg * bi[i]) * step_i[:, 0])
+            np.add.at(pu, u, lr * (err[:, None] * qi_b - reg * pu_b) * step_u)
+            np.add.at(qi, i, lr * (err[:, None] * pu_b - reg * qi_b) * step_i)
+
+    return SVDFactors(pu=pu, qi=qi, bu=bu, bi=bi, global_mean=mu,
+                      user_ids=user_ids, item_ids=item_ids,
+                      rating_scale=factors.rating_scale)
@@ -0,0 +1,198 @@
+"""
+
+    Offline pre-warming of recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to precompute the recommendations of the
+    movie triples selectable in the app, and store them where the app
+    looks before running a recommender. Work is spread over a process
+    pool. Triples which are already stored are skipped, so an interrupted
+    run resumes where it stopped when started again:
+
+        python resources/models/prewarm_recommendations.py --sample 20000
+
+"""
+# Script dependencies
+import argparse
+import itertools
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+
+# Make the repository packages importable when run as a script
+ROOT = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+from utils import registry
+from utils.data_loader import SELECTBOX_RANGES
+from utils.movie_index import rows_for_titles, titles_for_rows
+from utils.precomputed import (PrecomputedStore, STORE_PATH,
+                               source_fingerprint, store_key)
+
+def _recommenders():
+    """Return the undecorated recommenders, keyed by their cache name."""
+    from recommenders.collaborative_based import collab_model
+    from recommenders.content_based import content_model
+    # Bypass the result cache: every triple is computed once anyway
+    return {'content': content_model.__wrapped__,
+            'collaborative': collab_model.__wrapped__}
+
+def selectable_triples():
+    """Enumerate the catalogue rows of every selectable movie triple."""
+    return itertools.product(*(range(a, b) for a, b in SELECTBOX_RANGES))
+
+def sampled_triples(sample, seed=42):
+    """Enumerate a seeded random sample of the selectable movie triples.
+
+    Samples are prefixes of one seeded permutation of the triples, so a
+    larger sample contains every smaller one drawn with the same seed,
+    and resumes where it stopped.
+
+    """
+    sizes = [b - a for a, b in SELECTBOX_RANGES]
+    total = int(np.prod(sizes))
+    permutation = np.random.default_rng(seed).permutation(total)
+    picked = np.sort(permutation[:sample])
+    del permutation
+    offsets = np.unravel_index(picked, sizes)
+    starts = [a for a, _ in SELECTBOX_RANGES]
+    for triple in zip(*offsets):
+        yield tuple(int(start + offset)
+                    for start, offset in zip(starts, triple))
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def recommend_chunk(algorithm, top_n, triples):
+    """Compute the recommendations of a chunk of triples in a worker.
+
+    Returns
+    -------
+    list (tuple)
+        (key, recommended rows) pairs.
+
+    """
+    model = _recommenders()[algorithm]
+    movie_index = registry.get('movie_index')
+    results = []
+    for rows in triples:
+        titles = model(titles_for_rows(movie_index, rows), top_n)
+        results.append((store_key(algorithm, rows, top_n),
+                        rows_for_titles(movie_index, titles)))
+    return results
+
+def _warm_worker():
+    """Load the data and models once per worker process."""
+    _recommenders()
+    registry.get('movie_index')
+
+def _store_results(store, futures):
+    """Write the results of finished chunks and return their size."""
+    done = 0
+    for future in futures:
+        results = future.result()
+        store.put_many(results)
+        done += len(results)
+    return done
+
+def _report(algorithm, done, skipped, start):
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"\r{algorithm}: {done} computed, {skipped} already stored, "
+          f"{done / elapsed:.1f} triples/sec", end='', flush=True)
+
+def prewarm(algorithms, top_n=10, sample=None, workers=None,
+            chunk_size=200, seed=42, store_path=STORE_PATH):
+    """Precompute and store recommendations for the selectable triples.
+
+    Parameters
+    ----------
+    algorithms : list (str)
+        Recommenders to run: 'content' and/or 'collaborative'.
+    top_n : int
+        Number of recommendations per triple.
+    sample : int, optional
+        Only compute a seeded random sample of this many triples.
+        By default every selectable triple is computed.
+    workers : int, optional
+        Size of the process pool. Defaults to the number of CPUs.
+    chunk_size : int
+        Triples sent to a worker at a time.
+
+    """
+    store = PrecomputedStore(store_path)
+    fingerprint = source_fingerprint()
+    if store.get_meta('fingerprint') not in (None, fingerprint):
+        print("Data or model changed since the last run: recomputing all.")
+        store.clear()
+    store.set_meta('fingerprint', fingerprint)
+
+    # The app looks a title up by its first catalogue row, so triples
+    # holding a duplicated title are stored under that row
+    movie_index = registry.get('movie_index')
+    first_rows = rows_for_titles(movie_index, movie_index.titles)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_warm_worker) as pool:
+        # Chunks in flight at a time, so memory does not grow with the run
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        for algorithm in algorithms:
+            start = time.time()
+            done = skipped = 0
+            pending = set()
+            if sample is None:
+                triples = selectable_triples()
+            else:
+                triples = sampled_triples(sample, seed)
+            for chunk in chunked(triples, chunk_size):
+                keyed = {}
+                for rows in chunk:
+                    rows = tuple(int(r) for r in first_rows[list(rows)])
+                    keyed[store_key(algorithm, rows, top_n)] = rows
+                stored = store.existing(keyed)
+                todo = [rows for key, rows in keyed.items()
+                        if key not in stored]
+                skipped += len(keyed) - len(todo)
+                if not todo:
+                    continue
+                if len(pending) >= max_pending:
+                    finished, pending = wait(pending,
+                                             return_when=FIRST_COMPLETED)
+                    done += _store_results(store, finished)
+                    _report(algorithm, done, skipped, start)
+                pending.add(pool.submit(recommend_chunk, algorithm, top_n,
+                                        todo))
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += _store_results(store, finished)
+                _report(algorithm, done, skipped, start)
+            elapsed = time.time() - start
+            print(f"\r{algorithm}: {done} computed, {skipped} already stored "
+                  f"in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} "
+                  f"triples/sec)")
+    store.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Precompute recommendations for the app.')
+    parser.add_argument('--algorithms', nargs='+',
+                        default=['content', 'collaborative'],
+                        choices=['content', 'collaborative'])
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=None,
+                        help='number of random triples to compute '
+                             '(default: all of them)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=200)
+    args = parser.parse_args()
+    prewarm(args.algorithms, top_n=args.top_n, sample=args.sample,
+            workers=args.workers, chunk_size=args.chunk_size)
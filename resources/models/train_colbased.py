@@ -7,33 +7,218 @@
     Description: Simple script to train and save an instance of the
     SVDpp algorithm on MovieLens data.
 
+    A hyperparameter sweep (grid or random search over `n_factors`,
+    `lr_all`, `reg_all` and `n_epochs`) is scored by k-fold RMSE, with the
+    trials spread over a process pool. Each finished trial is appended to
+    a checkpoint file, so that an interrupted sweep resumes where it
+    stopped. The checkpoint is discarded when the ratings, the number of
+    folds or the seed change. The winning parameters are then fitted on
+    all ratings and the model is saved for the app, both as a pickle and
+    as a memory-mappable factor artifact:
+
+        python resources/models/train_colbased.py --trials 20
+
+    An existing pickle is converted to the artifact format with:
+
+        python resources/models/train_colbased.py --export-only
+
 """
 # Script dependencies
+import argparse
+import itertools
+import json
+import os
+import pathlib
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import pandas as pd
 from surprise import SVD
 import surprise
+from surprise.model_selection import KFold, cross_validate
 import pickle
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parents[2]
+# Make the repository packages importable when run as a script
+sys.path.insert(0, str(ROOT))
+
+from recommenders.svd_factors import extract_factors, publish_factors
+from utils.data_cache import file_sha1
+from utils.ingest import csv_chunks, ingest_ratings, ratings_frame
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+RATINGS_PATH = ROOT / 'resources' / 'data' / 'ratings.csv'
+MODEL_PATH = ROOT / 'resources' / 'models' / 'best_svd_model.pkl'
+FACTORS_PATH = ROOT / 'resources' / 'models' / 'svd_factors'
+CHECKPOINT_PATH = ROOT / 'resources' / 'models' / 'svd_sweep.jsonl'
 
-def svd_pp(save_path):
+# Hyperparameter values searched by default
+PARAM_GRID = {'n_factors': [50, 100, 200],
+              'lr_all': [0.002, 0.005, 0.01],
+              'reg_all': [0.02, 0.05, 0.1],
+              'n_epochs': [20, 40]}
+
+# Ratings loaded once per worker process
+_data = None
+
+def load_data(ratings_path):
+    # Importing datasets, streamed in chunks into compact arrays
+    ratings = ratings_frame(ingest_ratings(csv_chunks(ratings_path)))
     # Check the range of the rating
     min_rat = ratings['rating'].min()
     max_rat = ratings['rating'].max()
     # Changing ratings to their standard form
     reader = surprise.Reader(rating_scale = (min_rat,max_rat))
-    # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
+    # Loading the data frame using surprise
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+def _init_worker(ratings_path):
+    global _data
+    _data = load_data(ratings_path)
+
+def trial_key(params):
+    """Identify a trial by its parameters."""
+    return json.dumps(params, sort_keys=True)
+
+def evaluate_trial(params, n_folds, seed):
+    """Score one set of SVD parameters by k-fold RMSE in a worker."""
+    start = time.time()
+    method = SVD(init_std_dev = 0.05, random_state = seed, **params)
+    scores = cross_validate(method, _data, measures=['rmse'],
+                            cv=KFold(n_splits=n_folds, random_state=seed))
+    return {'params': params,
+            'rmse': float(np.mean(scores['test_rmse'])),
+            'rmse_std': float(np.std(scores['test_rmse'])),
+            'seconds': time.time() - start}
+
+def candidate_params(grid, n_trials=None, seed=42):
+    """List the grid's parameter sets, or a random sample of them."""
+    names = sorted(grid)
+    combos = [dict(zip(names, values))
+              for values in itertools.product(*(grid[n] for n in names))]
+    if n_trials is not None and n_trials < len(combos):
+        combos = random.Random(seed).sample(combos, n_trials)
+    return combos
+
+def sweep_setup(ratings_path, n_folds, seed):
+    """Describe what the scores of a sweep's trials depend on."""
+    return {'ratings_sha1': file_sha1(ratings_path), 'n_folds': n_folds,
+            'seed': seed}
+
+def load_checkpoint(checkpoint_path, setup):
+    """Read the finished trials of a previous (partial) sweep.
+
+    The first line of a checkpoint records the setup of its sweep.
+    Trials scored on other ratings, or with other folds or seed, are not
+    comparable, so such a checkpoint is ignored.
+
+    Returns
+    -------
+    dict or None
+        Finished trials keyed by `trial_key`, or None when there is no
+        checkpoint of this setup.
+
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    results = {}
+    with open(checkpoint_path) as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('setup') != setup:
+            return None
+        for line in f:
+            line = line.strip()
+            if line:
+                result = json.loads(line)
+                results[trial_key(result['params'])] = result
+    return results
+
+def sweep(ratings_path, checkpoint_path, grid=PARAM_GRID, n_trials=None,
+          n_folds=5, workers=None, seed=42):
+    """Run a hyperparameter sweep over a process pool.
+
+    Returns
+    -------
+    dict
+        The finished trial with the lowest mean RMSE.
+
+    """
+    setup = sweep_setup(ratings_path, n_folds, seed)
+    results = load_checkpoint(checkpoint_path, setup)
+    if results is None:
+        if os.path.exists(checkpoint_path):
+            print("Ratings, folds or seed changed since the checkpoint: "
+                  "starting a new sweep.")
+        results = {}
+        with open(checkpoint_path, 'w') as checkpoint:
+            checkpoint.write(json.dumps({'setup': setup}) + '\n')
+    todo = [p for p in candidate_params(grid, n_trials, seed)
+            if trial_key(p) not in results]
+    print(f"{len(results)} trials already finished, {len(todo)} to run.")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(ratings_path),)) as pool, \
+            open(checkpoint_path, 'a') as checkpoint:
+        futures = [pool.submit(evaluate_trial, p, n_folds, seed) for p in todo]
+        for future in as_completed(futures):
+            result = future.result()
+            results[trial_key(result['params'])] = result
+            # Checkpoint each trial as soon as it finishes
+            checkpoint.write(json.dumps(result) + '\n')
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            print(f"RMSE {result['rmse']:.4f} +/- {result['rmse_std']:.4f} "
+                  f"in {result['seconds']:.0f}s: {result['params']}")
+    return min(results.values(), key=lambda r: r['rmse'])
+
+def svd_pp(save_path, ratings_path=RATINGS_PATH, params=None):
+    if params is None:
+        params = dict(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40)
+    data_load = load_data(ratings_path)
     # Insatntiating surpricce
-    method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
+    method = SVD(init_std_dev = 0.05, **params)
     # Loading a trainset into the model
     model = method.fit(data_load.build_full_trainset())
     print (f"Training completed. Saving model to: {save_path}")
 
-    return pickle.dump(model, open(save_path,'wb'))
+    with open(save_path, 'wb') as f:
+        return pickle.dump(model, f)
+
+def export_factors(model_path, factors_path):
+    """Publish a pickled SVD model as the factor artifact served by the app."""
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    version = publish_factors(extract_factors(model), factors_path)
+    print(f"Published factors {version} to: {factors_path}")
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    parser = argparse.ArgumentParser(
+        description='Tune, train and save the SVD model used by the app.')
+    parser.add_argument('--ratings', default=str(RATINGS_PATH))
+    parser.add_argument('--output', default=str(MODEL_PATH))
+    parser.add_argument('--factors', default=str(FACTORS_PATH))
+    parser.add_argument('--checkpoint', default=str(CHECKPOINT_PATH))
+    parser.add_argument('--trials', type=int, default=None,
+                        help='number of random parameter sets to try '
+                             '(default: the full grid)')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='size of the process pool (default: all cores)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-sweep', action='store_true',
+                        help='skip the sweep and train the default model')
+    parser.add_argument('--export-only', action='store_true',
+                        help='only export the factors of the saved model')
+    args = parser.parse_args()
+
+    if args.export_only:
+        export_factors(args.output, args.factors)
+        sys.exit()
+
+    params = None
+    if not args.no_sweep:
+        best = sweep(args.ratings, args.checkpoint, n_trials=args.trials,
+                     n_folds=args.folds, workers=args.workers, seed=args.seed)
+        print(f"Best RMSE {best['rmse']:.4f}: {best['params']}")
+        params = best['params']
+    svd_pp(args.output, args.ratings, params)
+    export_factors(args.output, args.factors)
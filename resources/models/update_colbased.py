@@ -0,0 +1,94 @@
+"""
+
+    Incremental SVD model updates.
+
+    Author: Explore Data Science Academy.
+
+    Description: Simple script to fold new ratings into the served SVD
+    model without retraining it. The new ratings (a CSV file with the
+    columns of `ratings.csv`) are used to update only the factors and
+    biases of the users and movies they involve, and the result is
+    published as a new model version which running app processes swap
+    in on their next request:
+
+        python resources/models/update_colbased.py new_ratings.csv --append
+
+"""
+# Script dependencies
+import argparse
+import itertools
+import pathlib
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Make the repository packages importable when run as a script
+ROOT = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+from recommenders.collaborative_based import load_svd_factors
+from recommenders.svd_factors import partial_fit, publish_factors
+from utils import registry
+from utils.ingest import RATING_DTYPES, csv_chunks, ingest_ratings
+
+def affected_ratings(index, new_ratings):
+    """Return every rating of the users and movies in `new_ratings`."""
+    users = np.unique(index.user_ids.get_indexer(new_ratings['userId'].values))
+    items = np.unique(index.item_ids.get_indexer(new_ratings['movieId'].values))
+    by_user = index.matrix[users].tocoo()
+    by_item = index.matrix.tocsc()[:, items].tocoo()
+    rows = np.concatenate([users[by_user.row], by_item.row])
+    cols = np.concatenate([by_user.col, items[by_item.col]])
+    ratings = pd.DataFrame({'userId': index.user_ids.values[rows],
+                            'movieId': index.item_ids.values[cols],
+                            'rating': np.concatenate([by_user.data,
+                                                      by_item.data])})
+    return ratings.drop_duplicates(['userId', 'movieId'])
+
+def update_model(new_ratings_path, append=False, n_epochs=10, lr=0.005,
+                 reg=0.02):
+    """Update the served SVD model with new ratings and publish it.
+
+    Parameters
+    ----------
+    new_ratings_path : str
+        CSV file of new or changed ratings.
+    append : bool
+        Also append the new ratings to `ratings.csv`.
+    n_epochs, lr, reg : float
+        SGD settings of the update.
+
+    """
+    start = time.time()
+    new_ratings = pd.read_csv(new_ratings_path)
+    # Stream the existing ratings followed by the new ones; a changed
+    # rating replaces the previous one
+    index = ingest_ratings(itertools.chain(
+        csv_chunks(registry.RATINGS_PATH),
+        [new_ratings[list(RATING_DTYPES)].astype(RATING_DTYPES)]))
+    ratings = affected_ratings(index, new_ratings)
+
+    factors = partial_fit(load_svd_factors(), ratings, new_ratings,
+                          n_epochs=n_epochs, lr=lr, reg=reg)
+    version = publish_factors(factors, registry.SVD_FACTORS_PATH)
+    if append:
+        columns = pd.read_csv(registry.RATINGS_PATH, nrows=0).columns
+        new_ratings[columns].to_csv(registry.RATINGS_PATH, mode='a',
+                                    header=False, index=False)
+    print(f"Folded {len(new_ratings)} ratings into the model in "
+          f"{time.time() - start:.1f}s. Published version {version} to: "
+          f"{registry.SVD_FACTORS_PATH}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fold new ratings into the served SVD model.')
+    parser.add_argument('new_ratings', help='CSV file of new ratings')
+    parser.add_argument('--append', action='store_true',
+                        help='also append them to ratings.csv')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    args = parser.parse_args()
+    update_model(args.new_ratings, append=args.append, n_epochs=args.epochs,
+                 lr=args.lr, reg=args.reg)
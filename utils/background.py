@@ -0,0 +1,116 @@
+"""
+
+    Background execution of recommendation requests.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streamlit re-runs the app script on every interaction,
+    and a recommender called from the script blocks the page until it
+    returns. Requests are therefore submitted to a process-wide thread
+    pool instead, and their results are handed back as each recommender
+    finishes, so the app can show the fastest one first. A request that
+    has not finished within its timeout is reported as such; it keeps
+    running in the pool, and its result ends up in the result cache for
+    the next attempt. The same pool loads the shared data and models
+    when the app starts.
+
+"""
+# Script dependencies
+import concurrent.futures
+import threading
+
+from utils import registry
+from utils.instrumentation import incr
+
+MAX_WORKERS = 4
+# Seconds to wait for the recommenders of a request
+DEFAULT_TIMEOUT = 30.0
+
+_executor = None
+_lock = threading.Lock()
+
+def executor():
+    """Return the shared thread pool, creating it on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='recommender')
+        return _executor
+
+def warm(names):
+    """Load registry resources in the background.
+
+    Parameters
+    ----------
+    names : list (str)
+        Names of the registry resources to load.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Completes once every resource is loaded.
+
+    """
+    return executor().submit(lambda: [registry.get(name) for name in names])
+
+def submit(models, movie_list, top_n=10):
+    """Start several recommenders on the same request.
+
+    Parameters
+    ----------
+    models : dict
+        Label -> `*_model(movie_list, top_n)` function.
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of recommendations per recommender.
+
+    Returns
+    -------
+    dict
+        Future -> label of the recommender it runs.
+
+    """
+    pool = executor()
+    return {pool.submit(model, movie_list, top_n): label
+            for label, model in models.items()}
+
+def as_ready(futures, timeout=DEFAULT_TIMEOUT):
+    """Yield the results of submitted recommenders as they finish.
+
+    Parameters
+    ----------
+    futures : dict
+        Future -> label, as returned by `submit`.
+    timeout : float
+        Seconds to wait, in total, for all of them.
+
+    Yields
+    ------
+    tuple
+        Label, and either the recommended titles and None, or None and
+        the exception raised (a `TimeoutError` if it did not finish in
+        time).
+
+    """
+    pending = set(futures)
+    try:
+        for future in concurrent.futures.as_completed(futures,
+                                                      timeout=timeout):
+            pending.discard(future)
+            yield _outcome(futures[future], future)
+    except concurrent.futures.TimeoutError:
+        for future in [f for f in futures if f in pending]:
+            if future.done():
+                yield _outcome(futures[future], future)
+            else:
+                incr('background.timeouts')
+                yield futures[future], None, TimeoutError(
+                    f'{futures[future]} took longer than {timeout:g}s')
+
+def _outcome(label, future):
+    try:
+        return label, future.result(), None
+    except Exception as error:
+        return label, None, error
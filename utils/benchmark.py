@@ -0,0 +1,203 @@
+"""
+
+    Benchmark suite for the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Runs `content_model` and `collab_model` over a fixed,
+    seeded workload of movie triples drawn from the app's selectbox
+    ranges, and reports cold-start time, latency percentiles, throughput
+    and memory use as JSON. Cold starts are timed, and peak memory is
+    measured, in a fresh interpreter per recommender.
+    Run it from the root of the repository:
+
+        python -m utils.benchmark --requests 200 --output bench.json
+
+    Passing the JSON of an earlier run with `--baseline` exits with an
+    error when a latency percentile regressed by more than `--tolerance`.
+
+"""
+# Script dependencies
+import argparse
+import importlib
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from utils import registry
+from utils.data_loader import SELECTBOX_RANGES, load_movie_titles
+from utils.result_cache import recommendation_cache
+
+# Entry points under test: (module, function)
+RECOMMENDERS = {'content': ('recommenders.content_based', 'content_model'),
+                'collaborative': ('recommenders.collaborative_based',
+                                  'collab_model')}
+
+def workload(n_requests, seed=42):
+    """Draw a seeded list of movie triples offered by the app."""
+    titles = load_movie_titles(str(registry.MOVIES_PATH))
+    rng = np.random.default_rng(seed)
+    return [[titles[rng.integers(a, b)] for a, b in SELECTBOX_RANGES]
+            for _ in range(n_requests)]
+
+# Run in a fresh interpreter to time a true cold start, and to measure the
+# peak memory of one recommender on its own
+ISOLATED_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import importlib
+model = getattr(importlib.import_module(sys.argv[1]), sys.argv[2]).__wrapped__
+imported = time.perf_counter()
+request = json.load(sys.stdin)
+triples, top_n = request['triples'], request['top_n']
+model(triples[0], top_n)
+done = time.perf_counter()
+for triple in triples[1:]:
+    model(triple, top_n)
+from utils.benchmark import peak_rss_mb
+print(json.dumps({'import_ms': (imported - start) * 1000,
+                  'first_request_ms': (done - imported) * 1000,
+                  'peak_rss_mb': peak_rss_mb()}))
+'''
+
+def isolated_run(name, triples, top_n):
+    """Run a recommender over the workload in a new process.
+
+    Returns
+    -------
+    dict
+        Time taken by the import and by the first request, in
+        milliseconds, and the peak resident set size of the process over
+        the whole workload, in MiB.
+
+    """
+    module_name, fn_name = RECOMMENDERS[name]
+    out = subprocess.run([sys.executable, '-c', ISOLATED_SCRIPT,
+                          module_name, fn_name],
+                         input=json.dumps({'triples': triples,
+                                           'top_n': top_n}),
+                         cwd=registry.ROOT, capture_output=True, text=True,
+                         check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+def benchmark(name, triples, top_n=10, use_cache=False, trace_requests=20):
+    """Benchmark one recommender.
+
+    Parameters
+    ----------
+    name : str
+        Key of `RECOMMENDERS`.
+    triples : list (list (str))
+        Workload of favourite-movie triples.
+    use_cache : bool
+        Go through the result cache. By default every request is computed.
+    trace_requests : int
+        Requests replayed under tracemalloc to measure allocations.
+
+    Returns
+    -------
+    dict
+        Timings in milliseconds and memory use in MiB.
+
+    """
+    # Peak memory is per process, so each recommender is measured alone
+    isolated = isolated_run(name, triples, top_n)
+    module_name, fn_name = RECOMMENDERS[name]
+    model = getattr(importlib.import_module(module_name), fn_name)
+    if not use_cache:
+        model = model.__wrapped__
+    # Warm up, so the timings below exclude loading data and models
+    registry.clear()
+    recommendation_cache.clear()
+    model(triples[0], top_n)
+
+    latencies = np.empty(len(triples))
+    start = time.perf_counter()
+    for i, triple in enumerate(triples):
+        t = time.perf_counter()
+        model(triple, top_n)
+        latencies[i] = time.perf_counter() - t
+    wall = time.perf_counter() - start
+
+    tracemalloc.start()
+    for triple in triples[:trace_requests]:
+        model(triple, top_n)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {'requests': len(triples),
+            'cold_import_ms': isolated['import_ms'],
+            'cold_first_request_ms': isolated['first_request_ms'],
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'mean_ms': float(latencies.mean() * 1000),
+            'requests_per_sec': len(triples) / wall,
+            'peak_rss_mb': isolated['peak_rss_mb'],
+            'tracemalloc_peak_mb': traced_peak / 1024.0 ** 2}
+
+def compare(results, baseline, tolerance):
+    """List the latency percentiles that regressed against a baseline."""
+    regressions = []
+    for name, stats in results['recommenders'].items():
+        old = baseline.get('recommenders', {}).get(name)
+        if not old:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if stats[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {old[metric]:.2f} -> "
+                                   f"{stats[metric]:.2f}")
+    return regressions
+
+def run(algorithms, n_requests=200, seed=42, top_n=10, use_cache=False):
+    """Benchmark the given recommenders and collect the results."""
+    triples = workload(n_requests, seed)
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'seed': seed, 'top_n': top_n, 'use_cache': use_cache,
+               'recommenders': {}}
+    for name in algorithms:
+        results['recommenders'][name] = benchmark(name, triples, top_n,
+                                                  use_cache)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommenders.')
+    parser.add_argument('--algorithms', nargs='+', default=list(RECOMMENDERS),
+                        choices=list(RECOMMENDERS))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--use-cache', action='store_true',
+                        help='go through the result cache')
+    parser.add_argument('--output', help='write the JSON results to a file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative latency regression')
+    args = parser.parse_args()
+
+    results = run(args.algorithms, args.requests, args.seed, args.top_n,
+                  args.use_cache)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,324 @@
+"""
+
+    Columnar binary cache for the CSV datasets.
+
+    Author: Explore Data Science Academy.
+
+    Description: The first time a CSV file is read, each of its columns
+    is written to a `.npy` file in a `.cache` folder next to it. Later
+    reads memory-map those files instead of parsing the CSV again, so that
+    processes on one host share the numeric columns through the OS page
+    cache. Text columns are stored as UTF-8 bytes plus offsets, and
+    categorical columns as integer codes plus their categories. Large
+    files with only numeric columns, such as the ratings, can be read in
+    chunks with `read_csv_chunks_cached`, which writes the cache while
+    streaming the file.
+
+    A cached copy is keyed on the size, modification time and SHA-1 hash
+    of its CSV file, and is rebuilt automatically when the file changes.
+
+"""
+# Script dependencies
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+
+CACHE_FOLDER = '.cache'
+CACHE_VERSION = 1
+
+def file_sha1(path, chunk_size=1 << 20):
+    """Compute the SHA-1 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_dir(path):
+    """Return the folder holding the cached versions of a CSV file."""
+    path = pathlib.Path(path)
+    return path.parent / CACHE_FOLDER / path.stem
+
+def _write_json(path, obj):
+    """Write a JSON file atomically."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+def _write_columns(df, folder):
+    """Write every column of a dataframe to `.npy` files in a folder."""
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+        stem = folder / str(name)
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            np.save(f'{stem}.codes.npy', col.cat.codes.values)
+            columns[name] = {'kind': 'category',
+                             'categories': col.cat.categories.tolist()}
+        elif pd.api.types.is_numeric_dtype(col.dtype) \
+                or pd.api.types.is_bool_dtype(col.dtype):
+            np.save(f'{stem}.npy', col.values)
+            columns[name] = {'kind': 'numeric'}
+        else:
+            missing = col.isna().values
+            encoded = [s.encode('utf-8') for s in col.fillna('').astype(str)]
+            lengths = np.fromiter((len(s) for s in encoded), dtype=np.int64,
+                                  count=len(encoded))
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            np.save(f'{stem}.bytes.npy',
+                    np.frombuffer(b''.join(encoded), dtype=np.uint8))
+            np.save(f'{stem}.offsets.npy', offsets)
+            if missing.any():
+                np.save(f'{stem}.missing.npy', missing)
+            columns[name] = {'kind': 'string', 'missing': bool(missing.any())}
+    return columns
+
+def _read_columns(folder, columns):
+    """Read the columns written by `_write_columns`, memory-mapping arrays."""
+    data = {}
+    for name, info in columns.items():
+        stem = folder / name
+        if info['kind'] == 'category':
+            codes = np.load(f'{stem}.codes.npy', mmap_mode='r')
+            data[name] = pd.Categorical.from_codes(codes, info['categories'])
+        elif info['kind'] == 'numeric':
+            data[name] = np.load(f'{stem}.npy', mmap_mode='r')
+        else:
+            raw = np.load(f'{stem}.bytes.npy', mmap_mode='r').tobytes()
+            offsets = np.load(f'{stem}.offsets.npy').tolist()
+            values = np.array([raw[a:b].decode('utf-8')
+                               for a, b in zip(offsets[:-1], offsets[1:])],
+                              dtype=object)
+            if info['missing']:
+                values[np.load(f'{stem}.missing.npy')] = np.nan
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+def _lookup(path, read_csv_kwargs):
+    """Locate the cache of a CSV file and read its pointer, if any."""
+    path = pathlib.Path(path).resolve()
+    folder = cache_dir(path)
+    stat = path.stat()
+    options = json.dumps(read_csv_kwargs, sort_keys=True, default=str)
+    options_key = hashlib.sha1(options.encode()).hexdigest()[:12]
+    pointer = folder / f'current-{options_key}.json'
+    try:
+        current = json.loads(pointer.read_text())
+    except (OSError, ValueError):
+        current = None
+    return path, folder, stat, options, pointer, current
+
+def _read_current(folder, stat, current):
+    """Read the cached copy if the CSV file was not touched since."""
+    unchanged = (stat.st_size, stat.st_mtime_ns)
+    if current is not None and current['version'] == CACHE_VERSION and \
+            (current['size'], current['mtime_ns']) == unchanged:
+        try:
+            return _read_columns(folder / current['key'], current['columns'])
+        except (OSError, ValueError):
+            pass
+    return None
+
+def _cache_key(sha1, options):
+    """Name the cached copy of a CSV file's contents read with options."""
+    digest = hashlib.sha1(f'{sha1}{options}{CACHE_VERSION}'.encode())
+    return digest.hexdigest()[:16]
+
+def _reuse(folder, key, pointer, current, stat):
+    """Re-point the cache at a touched but unchanged CSV file."""
+    if current is not None and current['key'] == key and \
+            (folder / key).is_dir():
+        current.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        _write_json(pointer, current)
+        return _read_columns(folder / key, current['columns'])
+    return None
+
+def _new_build(folder, key):
+    """Create the folder a new cached copy is written to."""
+    folder.mkdir(parents=True, exist_ok=True)
+    build = pathlib.Path(tempfile.mkdtemp(dir=folder, prefix=f'{key}.tmp'))
+    # Other worker processes (and users) read the cache too
+    os.chmod(build, 0o755)
+    return build
+
+def _install(path, folder, build, key, sha1, stat, pointer, current,
+             columns):
+    """Move a finished build into place and point the cache at it."""
+    if (folder / key).exists():
+        shutil.rmtree(build)
+    else:
+        os.replace(build, folder / key)
+    _write_json(pointer, {'version': CACHE_VERSION, 'key': key,
+                          'source': str(path), 'sha1': sha1,
+                          'size': stat.st_size,
+                          'mtime_ns': stat.st_mtime_ns,
+                          'columns': columns})
+    if current is not None and current['key'] != key:
+        shutil.rmtree(folder / current['key'], ignore_errors=True)
+
+def read_csv_cached(path, **read_csv_kwargs):
+    """Read a CSV file through the columnar binary cache.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the CSV file.
+    **read_csv_kwargs
+        Arguments passed to `pandas.read_csv` when the cache is (re)built,
+        e.g. `usecols` and `dtype`. They are part of the cache key.
+
+    Returns
+    -------
+    Pandas Dataframe
+        The CSV contents. Numeric columns are read-only memory maps.
+
+    """
+    path, folder, stat, options, pointer, current = _lookup(path,
+                                                           read_csv_kwargs)
+    cached = _read_current(folder, stat, current)
+    if cached is not None:
+        return cached
+
+    # The file is new or was touched: only rebuild if its contents changed
+    sha1 = file_sha1(path)
+    key = _cache_key(sha1, options)
+    cached = _reuse(folder, key, pointer, current, stat)
+    if cached is not None:
+        return cached
+
+    df = pd.read_csv(path, **read_csv_kwargs)
+    try:
+        build = _new_build(folder, key)
+        columns = _write_columns(df, build)
+        _install(path, folder, build, key, sha1, stat, pointer, current,
+                 columns)
+    except OSError as e:
+        warnings.warn(f"Could not cache {path}: {e}")
+        return df
+    return _read_columns(folder / key, columns)
+
+class _ColumnParts:
+    """Appends the numeric columns of CSV chunks to raw files in a build.
+
+    `finish` turns them into the `.npy` files of `_write_columns`.
+
+    """
+
+    def __init__(self, build):
+        self.build = build
+        # name -> [file, dtype, number of values]
+        self.parts = {}
+
+    def append(self, chunk):
+        for name in chunk.columns:
+            col = chunk[name]
+            if not pd.api.types.is_numeric_dtype(col.dtype) or \
+                    isinstance(col.dtype, pd.CategoricalDtype):
+                raise ValueError(f"column '{name}' is not numeric")
+            values = np.ascontiguousarray(col.values)
+            part = self.parts.get(name)
+            if part is None:
+                part = [open(self.build / f'{name}.part', 'wb'),
+                        values.dtype, 0]
+                self.parts[name] = part
+            elif values.dtype != part[1]:
+                raise ValueError(f"column '{name}' changed type")
+            values.tofile(part[0])
+            part[2] += values.size
+
+    def close(self):
+        for f, _, _ in self.parts.values():
+            f.close()
+
+    def finish(self):
+        self.close()
+        columns = {}
+        for name, (_, dtype, size) in self.parts.items():
+            raw = self.build / f'{name}.part'
+            with open(self.build / f'{name}.npy', 'wb') as out:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(dtype),
+                    'fortran_order': False, 'shape': (size,)})
+                with open(raw, 'rb') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+            raw.unlink()
+            columns[name] = {'kind': 'numeric'}
+        return columns
+
+def read_csv_chunks_cached(path, chunksize=1_000_000, **read_csv_kwargs):
+    """Read a CSV file in chunks through the columnar binary cache.
+
+    Uses the same cache as `read_csv_cached` with the same arguments. When
+    there is no up-to-date cached copy, the CSV file is parsed in chunks
+    and every chunk is appended to the cached columns as it is read, so
+    that the file is never held in memory as a whole. Only numeric columns
+    are cached this way; files with other columns are just read.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the CSV file.
+    chunksize : int
+        Number of rows per chunk.
+    **read_csv_kwargs
+        Arguments passed to `pandas.read_csv`, as for `read_csv_cached`.
+
+    Yields
+    ------
+    Pandas Dataframe
+        Consecutive chunks of the CSV contents.
+
+    """
+    path, folder, stat, options, pointer, current = _lookup(path,
+                                                           read_csv_kwargs)
+    cached = _read_current(folder, stat, current)
+    if cached is None:
+        sha1 = file_sha1(path)
+        key = _cache_key(sha1, options)
+        cached = _reuse(folder, key, pointer, current, stat)
+    if cached is not None:
+        for start in range(0, len(cached), chunksize):
+            yield cached.iloc[start:start + chunksize]
+        return
+
+    try:
+        build = _new_build(folder, key)
+    except OSError as e:
+        warnings.warn(f"Could not cache {path}: {e}")
+        build = None
+    parts = None if build is None else _ColumnParts(build)
+    try:
+        with pd.read_csv(path, chunksize=chunksize,
+                         **read_csv_kwargs) as reader:
+            for chunk in reader:
+                if parts is not None:
+                    try:
+                        parts.append(chunk)
+                    except (OSError, ValueError) as e:
+                        warnings.warn(f"Could not cache {path}: {e}")
+                        parts.close()
+                        parts = None
+                yield chunk
+        if parts is not None:
+            try:
+                columns = parts.finish()
+                _install(path, folder, build, key, sha1, stat, pointer,
+                         current, columns)
+                build = None
+            except OSError as e:
+                warnings.warn(f"Could not cache {path}: {e}")
+    finally:
+        # An unfinished build, e.g. when the reader stopped early
+        if parts is not None:
+            parts.close()
+        if build is not None:
+            shutil.rmtree(build, ignore_errors=True)
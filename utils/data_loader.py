@@ -6,12 +6,23 @@
 
 """
 # Data handling dependencies
-import pandas as pd
+import pathlib
 import numpy as np
 
+from utils import registry
+from utils.data_cache import read_csv_cached
+
+# Slices of the title list offered by the three favourite-movie
+# selectboxes of `edsa_recommender.py`.
+SELECTBOX_RANGES = ((14930, 15200), (25055, 25255), (21100, 21200))
+
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
 
+    The bundled movie database is read once per process through the
+    shared data registry; other paths are read through the columnar
+    binary cache.
+
     Parameters
     ----------
     path_to_movies : str
@@ -24,7 +35,10 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
-    df = df.dropna()
+    if pathlib.Path(path_to_movies).resolve() == registry.MOVIES_PATH:
+        df = registry.get('movies')
+    else:
+        df = read_csv_cached(path_to_movies)
+        df = df.dropna()
     movie_list = df['title'].to_list()
     return movie_list
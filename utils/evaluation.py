@@ -0,0 +1,471 @@
+"""
+
+    Offline evaluation of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures the ranking quality of the content, collaborative
+    and SVD recommenders on a held-out split of the ratings. A seeded
+    fraction of the ratings of every user is held out as the test set;
+    the SVD model is fitted on the rest, and the collaborative model only
+    sees the rest too. Every evaluated user then gets a top-k list from
+    each model:
+
+      - SVD: the unrated movies with the highest estimated rating,
+      - content and collaborative: the recommendations for the user's
+        highest-rated training movies, as if chosen in the app.
+
+    Movies the user rated in training are left out of every list, since
+    they can never be relevant.
+
+    Held-out movies rated at least `RELEVANCE_THRESHOLD` are relevant,
+    from which precision@k, recall@k and NDCG@k are averaged over the
+    users, along with the coverage (share of the rated movies recommended
+    to at least one user) and, for SVD, the RMSE on the held-out ratings.
+    Users are scored in batches: the SVD estimates of a whole batch are a
+    single matrix product, the content and collaborative requests go
+    through the `*_model_batch` functions, and the metrics of a batch are
+    computed from one matrix of hits. Run it from the root of the
+    repository:
+
+        python -m utils.evaluation --k 10 --output evaluation.json
+
+    `resources/models/Train_NM2.pkl` and `Test_NM2.pkl` hold rating
+    counts without user or movie IDs, so the split is drawn from the
+    ratings instead.
+
+"""
+# Script dependencies
+import argparse
+from collections import namedtuple
+import json
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from recommenders.collaborative_based import collab_model_batch, svd_factors
+from recommenders.content_based import content_model_batch
+from recommenders.svd_factors import (build_svd_index, extract_factors,
+                                      item_rows)
+from utils import registry
+from utils.ingest import RatingsIndex, ratings_frame
+from utils.movie_index import rows_for_movie_ids
+from utils.ranking import top_k_rows
+
+# Held-out ratings at or above this value are relevant
+RELEVANCE_THRESHOLD = 4.0
+
+# Parameters of the SVD model fitted on the training split, as in
+# `resources/models/train_colbased.py`
+SVD_PARAMS = {'n_factors': 200, 'lr_all': 0.005, 'reg_all': 0.02,
+              'n_epochs': 40}
+
+# Users scored per batch by the SVD model, and requests per call to the
+# `*_model_batch` functions
+USER_BATCH = 512
+REQUEST_BATCH = 64
+
+# Number of training movies standing in for the movies chosen in the app
+N_SEEDS = 3
+
+# Training and held-out ratings, as two RatingsIndex over the same
+# users and movies
+HoldoutSplit = namedtuple('HoldoutSplit', ['train', 'test'])
+
+# Arrays shared by the rankers. `relevant_keys` holds the sorted
+# `row * n_columns + column` keys of the relevant held-out ratings, and
+# `n_relevant` their number per user row. `catalogue_rows` maps rating
+# columns to catalogue rows and `catalogue_columns` the reverse (-1 where
+# unknown). `user_rows`, `item_factors` and `item_biases` align the SVD
+# parameters with the rating rows and columns.
+EvaluationData = namedtuple('EvaluationData', [
+    'train', 'test', 'relevant_keys', 'n_relevant', 'catalogue_rows',
+    'catalogue_columns', 'factors', 'user_rows', 'item_factors',
+    'item_biases'])
+
+def _row_numbers(matrix):
+    """Return the row of every stored entry of a CSR matrix."""
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+def _subset(index, keep, rows):
+    """Keep some of the ratings of a RatingsIndex, with the same ID maps."""
+    matrix = index.matrix
+    n_users, n_items = matrix.shape
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[keep], minlength=n_users), out=indptr[1:])
+    subset = scipy.sparse.csr_matrix(
+        (matrix.data[keep], matrix.indices[keep], indptr),
+        shape=matrix.shape)
+    item_count = np.bincount(subset.indices, minlength=n_items)
+    item_sum = np.bincount(subset.indices, weights=subset.data,
+                           minlength=n_items)
+    item_mean = np.divide(item_sum, item_count, out=np.zeros(n_items),
+                          where=item_count > 0).astype(np.float32)
+    return RatingsIndex(matrix=subset, user_ids=index.user_ids,
+                        item_ids=index.item_ids, item_count=item_count,
+                        item_mean=item_mean)
+
+def split_ratings(index, test_size=0.2, min_ratings=5, seed=42):
+    """Hold out a random fraction of the ratings of every user.
+
+    Parameters
+    ----------
+    index : RatingsIndex
+        All ratings.
+    test_size : float
+        Fraction of each user's ratings held out, rounded to at least one
+        and leaving at least one for training.
+    min_ratings : int
+        Users with fewer ratings keep all of them for training.
+    seed : int
+        Seed of the random split.
+
+    Returns
+    -------
+    HoldoutSplit
+        Training and held-out ratings.
+
+    """
+    matrix = index.matrix
+    lengths = np.diff(matrix.indptr)
+    rows = _row_numbers(matrix)
+    rng = np.random.default_rng(seed)
+    # Shuffling the ratings within each row by sorting on random keys
+    order = np.lexsort((rng.random(rows.size), rows))
+    rank = np.empty(rows.size, dtype=np.int64)
+    rank[order] = np.arange(rows.size) - matrix.indptr[rows[order]]
+    n_test = np.rint(lengths * test_size).astype(np.int64)
+    n_test = np.where(lengths >= max(min_ratings, 2),
+                      np.clip(n_test, 1, np.maximum(lengths - 1, 1)), 0)
+    held_out = rank < n_test[rows]
+    return HoldoutSplit(train=_subset(index, ~held_out, rows),
+                        test=_subset(index, held_out, rows))
+
+def fit_svd(train, params=None, seed=42):
+    """Fit a surprise SVD model on the training ratings.
+
+    Returns
+    -------
+    SVDFactors
+        Parameters of the fitted model.
+
+    """
+    # Only needed to fit the model, unlike the rest of the app
+    import surprise
+    ratings = ratings_frame(train)
+    reader = surprise.Reader(rating_scale=(float(ratings['rating'].min()),
+                                           float(ratings['rating'].max())))
+    data = surprise.Dataset.load_from_df(ratings, reader)
+    model = surprise.SVD(init_std_dev=0.05, random_state=seed,
+                         **(SVD_PARAMS if params is None else params))
+    return extract_factors(model.fit(data.build_full_trainset()))
+
+def evaluation_data(split, factors, threshold=RELEVANCE_THRESHOLD):
+    """Gather the arrays the rankers and metrics share."""
+    test = split.test.matrix
+    relevant = test.data >= threshold
+    relevant_rows = _row_numbers(test)[relevant]
+    relevant_keys = np.sort(relevant_rows.astype(np.int64) * test.shape[1]
+                            + test.indices[relevant])
+    n_relevant = np.bincount(relevant_rows, minlength=test.shape[0])
+
+    movie_index = registry.get('movie_index')
+    item_ids = split.train.item_ids
+    catalogue_rows = rows_for_movie_ids(movie_index, item_ids)
+    catalogue_columns = item_ids.get_indexer(movie_index.movie_ids)
+
+    # Movies unknown to the model only get the global mean and user bias,
+    # as in `predict_matrix`
+    items = item_rows(factors, item_ids)
+    known = items >= 0
+    item_factors = np.where(known[:, None], factors.qi[items],
+                            0).astype(np.float32)
+    item_biases = np.where(known, factors.bi[items], 0).astype(np.float32)
+    user_rows = pd.Index(factors.user_ids).get_indexer(split.train.user_ids)
+    return EvaluationData(train=split.train, test=split.test,
+                          relevant_keys=relevant_keys, n_relevant=n_relevant,
+                          catalogue_rows=catalogue_rows,
+                          catalogue_columns=catalogue_columns,
+                          factors=factors, user_rows=user_rows,
+                          item_factors=item_factors, item_biases=item_biases)
+
+def evaluation_users(data):
+    """Return the rows of the users with training and relevant test ratings."""
+    has_train = np.diff(data.train.matrix.indptr) > 0
+    return np.flatnonzero(has_train & (data.n_relevant > 0))
+
+def svd_rankings(data, users, k):
+    """Rank the unrated movies of a batch of users by SVD estimate.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n_users x k) rating columns, -1 where fewer movies are left.
+
+    """
+    user_rows = data.user_rows[users]
+    known = user_rows >= 0
+    pu = np.where(known[:, None], data.factors.pu[user_rows], 0)
+    # The global mean and user bias do not change the order of a row
+    scores = pu.astype(np.float32) @ data.item_factors.T
+    scores += data.item_biases
+    # Movies rated in training are not recommended again
+    rated = data.train.matrix[users]
+    scores[_row_numbers(rated), rated.indices] = -np.inf
+    return top_k_rows(scores, k)
+
+def seed_titles(data, users, n_seeds=N_SEEDS):
+    """Return the highest-rated training movies of each user.
+
+    Ties are broken by the order of the rating columns. Movies missing
+    from the catalogue are skipped.
+
+    Returns
+    -------
+    list (list (str))
+        Up to `n_seeds` titles per user.
+
+    """
+    titles = registry.get('movie_index').titles
+    rated = data.train.matrix[users]
+    rows = _row_numbers(rated)
+    catalogue = data.catalogue_rows[rated.indices]
+    listed = catalogue >= 0
+    rows, catalogue = rows[listed], catalogue[listed]
+    order = np.lexsort((rated.indices[listed], -rated.data[listed], rows))
+    rows, catalogue = rows[order], catalogue[order]
+    starts = np.searchsorted(rows, np.arange(len(users)))
+    ends = np.minimum(np.searchsorted(rows, np.arange(len(users)),
+                                      side='right'), starts + n_seeds)
+    return [titles[catalogue[start:end]].tolist()
+            for start, end in zip(starts, ends)]
+
+def _title_rankings(batch_model, data, users, k):
+    """Rank movies for a batch of users with a `*_model_batch` function.
+
+    The model is asked for `k` more movies than the most training ratings
+    of a user in the batch, so that `k` are left once the movies rated in
+    training are removed.
+
+    """
+    title_rows = registry.get('movie_index').title_rows
+    seeds = seed_titles(data, users)
+    asked = [i for i, titles in enumerate(seeds) if titles]
+    rankings = np.full((len(users), k), -1, dtype=np.int64)
+    if asked:
+        rated = data.train.matrix[users]
+        depth = k + int(np.diff(rated.indptr)[asked].max())
+        # The undecorated function, so that results are never cached
+        recommended = batch_model.__wrapped__([seeds[i] for i in asked],
+                                              depth)
+        for i, titles in zip(asked, recommended):
+            rows = np.array([title_rows[title] for title in titles],
+                            dtype=np.int64)
+            columns = data.catalogue_columns[rows]
+            seen = rated.indices[rated.indptr[i]:rated.indptr[i + 1]]
+            columns = columns[~np.isin(columns, seen)][:k]
+            rankings[i, :columns.size] = columns
+    return rankings
+
+def content_rankings(data, users, k):
+    """Rank movies for a batch of users with `content_model_batch`."""
+    return _title_rankings(content_model_batch, data, users, k)
+
+def collab_rankings(data, users, k):
+    """Rank movies for a batch of users with `collab_model_batch`."""
+    return _title_rankings(collab_model_batch, data, users, k)
+
+# Rankers under evaluation, with the number of users ranked per call
+RANKERS = {'content': (content_rankings, REQUEST_BATCH),
+           'collaborative': (collab_rankings, REQUEST_BATCH),
+           'svd': (svd_rankings, USER_BATCH)}
+
+def ranking_metrics(data, users, rankings):
+    """Compute the precision, recall and NDCG at k of a batch of users.
+
+    Parameters
+    ----------
+    data : EvaluationData
+        Output of `evaluation_data`.
+    users : numpy.ndarray
+        Rating rows of the users, each with at least one relevant movie.
+    rankings : numpy.ndarray
+        (n_users x k) rating columns recommended to them, -1 for none.
+
+    Returns
+    -------
+    tuple (numpy.ndarray)
+        Precision, recall and NDCG of every user.
+
+    """
+    k = rankings.shape[1]
+    keys = (users[:, None].astype(np.int64) * data.test.matrix.shape[1]
+            + rankings)
+    found = np.searchsorted(data.relevant_keys, keys)
+    found = np.minimum(found, data.relevant_keys.size - 1)
+    hits = (rankings >= 0) & (data.relevant_keys[found] == keys)
+    n_hits = hits.sum(axis=1)
+    n_relevant = data.n_relevant[users]
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    return n_hits / k, n_hits / n_relevant, (hits @ discounts) / ideal
+
+def svd_rmse(data, chunk_size=1_000_000):
+    """Compute the RMSE of the SVD estimates of the held-out ratings.
+
+    Estimates match `surprise.SVD.estimate`, clipped to the rating scale.
+
+    """
+    test = data.test.matrix
+    factors = data.factors
+    rows = _row_numbers(test)
+    squared = 0.0
+    for start in range(0, test.nnz, chunk_size):
+        users = data.user_rows[rows[start:start + chunk_size]]
+        cols = test.indices[start:start + chunk_size]
+        known = users >= 0
+        est = np.full(cols.size, factors.global_mean, dtype=np.float64)
+        est[known] += factors.bu[users[known]]
+        est += data.item_biases[cols]
+        est[known] += np.einsum('ij,ij->i', factors.pu[users[known]],
+                                data.item_factors[cols[known]])
+        np.clip(est, *factors.rating_scale, out=est)
+        squared += float(((est - test.data[start:start + chunk_size]) ** 2)
+                         .sum())
+    return float(np.sqrt(squared / max(test.nnz, 1)))
+
+def evaluate_model(name, data, users, k=10, batch_size=None):
+    """Average the ranking metrics of one model over the given users.
+
+    Returns
+    -------
+    dict
+        Mean precision, recall and NDCG at k, coverage, RMSE (None for
+        models which do not estimate ratings) and the time taken.
+
+    """
+    ranker, default_batch = RANKERS[name]
+    batch_size = batch_size or default_batch
+    start = time.perf_counter()
+    totals = np.zeros(3)
+    covered = np.zeros(data.train.matrix.shape[1], dtype=bool)
+    for first in range(0, users.size, batch_size):
+        batch = users[first:first + batch_size]
+        rankings = ranker(data, batch, k)
+        totals += [metric.sum() for metric in
+                   ranking_metrics(data, batch, rankings)]
+        covered[rankings[rankings >= 0]] = True
+    totals /= max(users.size, 1)
+    return {'precision': float(totals[0]), 'recall': float(totals[1]),
+            'ndcg': float(totals[2]), 'coverage': float(covered.mean()),
+            'rmse': svd_rmse(data) if name == 'svd' else None,
+            'seconds': time.perf_counter() - start}
+
+def evaluate(models=tuple(RANKERS), k=10, test_size=0.2, min_ratings=5,
+             threshold=RELEVANCE_THRESHOLD, seed=42, n_users=None,
+             svd_params=None, app_model=False, batch_sizes=None):
+    """Split the ratings, fit the SVD model and evaluate the given models.
+
+    Parameters
+    ----------
+    models : list (str)
+        Keys of `RANKERS` to evaluate.
+    k : int
+        Length of the recommendation lists.
+    test_size, min_ratings, seed
+        Parameters of `split_ratings`. The seed also draws the users and
+        initialises the SVD model.
+    threshold : float
+        Lowest held-out rating of a relevant movie.
+    n_users : int, optional
+        Number of users drawn at random to evaluate; all of them by
+        default.
+    svd_params : dict, optional
+        Parameters of the SVD model fitted on the training ratings.
+    app_model : bool
+        Evaluate the app's SVD model instead of fitting one. The model
+        may have been trained on held-out ratings, which inflates its
+        scores.
+    batch_sizes : dict, optional
+        Number of users ranked per call, per model.
+
+    Returns
+    -------
+    dict
+        Settings and metrics of every model, serialisable as JSON.
+
+    """
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'k': k,
+               'test_size': test_size, 'min_ratings': min_ratings,
+               'threshold': threshold, 'seed': seed, 'app_model': app_model}
+    start = time.perf_counter()
+    split = split_ratings(registry.get('ratings_index'), test_size,
+                          min_ratings, seed)
+    results['split_seconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    if app_model:
+        factors = svd_factors()
+    else:
+        factors = fit_svd(split.train, svd_params, seed)
+    results['fit_seconds'] = time.perf_counter() - start
+    data = evaluation_data(split, factors, threshold)
+    users = evaluation_users(data)
+    if n_users is not None and n_users < users.size:
+        rng = np.random.default_rng(seed)
+        users = np.sort(rng.choice(users, n_users, replace=False))
+    results['users'] = int(users.size)
+    results['test_ratings'] = int(split.test.matrix.nnz)
+
+    # The collaborative model reads the ratings and SVD model from the
+    # registry, so it is pointed at the training split for the run
+    registry.attach('ratings_index', lambda: split.train)
+    registry.attach('svd_factors', lambda: factors)
+    registry.attach('svd_index', lambda: build_svd_index(factors))
+    results['models'] = {}
+    try:
+        for name in models:
+            results['models'][name] = evaluate_model(
+                name, data, users, k, (batch_sizes or {}).get(name))
+    finally:
+        registry.detach('ratings_index')
+        registry.detach('svd_factors')
+        registry.detach('svd_index')
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Evaluate the recommenders on held-out ratings.')
+    parser.add_argument('--models', nargs='+', default=list(RANKERS),
+                        choices=list(RANKERS))
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--min-ratings', type=int, default=5)
+    parser.add_argument('--threshold', type=float,
+                        default=RELEVANCE_THRESHOLD)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=None,
+                        help='evaluate a random sample of users')
+    parser.add_argument('--svd-params', type=json.loads, default=None,
+                        help='JSON parameters of the SVD model fitted on '
+                             'the training split (default: %s)'
+                             % json.dumps(SVD_PARAMS))
+    parser.add_argument('--app-model', action='store_true',
+                        help="evaluate the app's SVD model instead of "
+                             'fitting one on the training split')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='users ranked per call (default: %d for SVD, '
+                             '%d for the others)'
+                             % (USER_BATCH, REQUEST_BATCH))
+    parser.add_argument('--output', help='write the JSON results to a file')
+    args = parser.parse_args()
+
+    results = evaluate(args.models, args.k, args.test_size, args.min_ratings,
+                       args.threshold, args.seed, args.users,
+                       args.svd_params, args.app_model,
+                       {name: args.batch_size for name in args.models})
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
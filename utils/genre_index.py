@@ -0,0 +1,155 @@
+"""
+
+    Inverted index from genre to movies.
+
+    Author: Explore Data Science Academy.
+
+    Description: Most of the catalogue shares no genre with a given set of
+    favourite movies, and so cannot be similar to them by genre. The index
+    below maps every genre to the sorted catalogue rows of its movies (a
+    posting list), so the recommenders can collect the movies sharing a
+    genre with the chosen ones and score only those. Posting lists are
+    combined by sorted-array intersection, and by sorted-array or bitset
+    union depending on how much of the catalogue they cover.
+
+"""
+# Data handling dependencies
+from collections import namedtuple
+import numpy as np
+
+# Posting lists in CSR form: the rows of genre `vocabulary[g]` are
+# `rows[indptr[g]:indptr[g + 1]]`. The genres of catalogue row r are
+# `row_genres[row_indptr[r]:row_indptr[r + 1]]`.
+GenreIndex = namedtuple('GenreIndex', ['vocabulary', 'indptr', 'rows',
+                                       'row_indptr', 'row_genres'])
+
+def build_genre_index(movies):
+    """Build the inverted genre index of a movie catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Catalogue with a 'genres' column of '|'-separated genres.
+
+    Returns
+    -------
+    GenreIndex
+        Posting lists of int32 catalogue rows, sorted within each genre.
+
+    """
+    genres = movies['genres'].astype('category')
+    codes = genres.cat.codes.to_numpy()
+    # Splitting each distinct genre combination once
+    vocabulary = {}
+    combos = [[vocabulary.setdefault(genre, len(vocabulary))
+               for genre in str(combo).split('|')]
+              for combo in genres.cat.categories]
+    combo_lengths = np.array([len(c) for c in combos] + [0], dtype=np.int64)
+    combo_starts = np.concatenate([[0], np.cumsum(combo_lengths)[:-1]])
+    combo_genres = np.array([g for c in combos for g in c], dtype=np.int32)
+    # Missing genres (code -1) map to the trailing empty combination
+    codes = np.where(codes < 0, len(combos), codes)
+
+    lengths = combo_lengths[codes]
+    row_indptr = np.zeros(codes.size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=row_indptr[1:])
+    positions = (np.repeat(combo_starts[codes] - row_indptr[:-1], lengths)
+                 + np.arange(row_indptr[-1]))
+    row_genres = combo_genres[positions]
+
+    # A stable sort by genre keeps the rows of each genre in order
+    order = np.argsort(row_genres, kind='stable')
+    rows = np.repeat(np.arange(codes.size, dtype=np.int32), lengths)[order]
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_genres, minlength=len(vocabulary)),
+              out=indptr[1:])
+    return GenreIndex(vocabulary=vocabulary, indptr=indptr, rows=rows,
+                      row_indptr=row_indptr, row_genres=row_genres)
+
+def postings(index, genre_ids):
+    """Return the posting lists of the given genres."""
+    return [index.rows[index.indptr[g]:index.indptr[g + 1]]
+            for g in genre_ids]
+
+def genres_of(index, row):
+    """Return the genre ids of a catalogue row."""
+    return index.row_genres[index.row_indptr[row]:index.row_indptr[row + 1]]
+
+def union_rows(lists, n_rows):
+    """Merge sorted posting lists into one sorted array of unique rows.
+
+    Lists covering a large part of the catalogue are merged through a
+    bitset, smaller ones by sorting their concatenation.
+
+    """
+    lists = [rows for rows in lists if rows.size]
+    if not lists:
+        return np.empty(0, dtype=np.int32)
+    if len(lists) == 1:
+        return lists[0]
+    if sum(rows.size for rows in lists) * 8 > n_rows:
+        bitset = np.zeros(n_rows, dtype=bool)
+        for rows in lists:
+            bitset[rows] = True
+        return np.flatnonzero(bitset).astype(np.int32)
+    return np.unique(np.concatenate(lists))
+
+def intersect_rows(lists):
+    """Intersect sorted posting lists, starting with the shortest."""
+    if not lists:
+        return np.empty(0, dtype=np.int32)
+    lists = sorted(lists, key=len)
+    common = lists[0]
+    for rows in lists[1:]:
+        if common.size == 0:
+            break
+        common = np.intersect1d(common, rows, assume_unique=True)
+    return common
+
+def chosen_genres(index, rows):
+    """Return the sorted ids of the genres of any of the given rows."""
+    return np.unique(np.concatenate([genres_of(index, r) for r in rows]))
+
+def posting_sizes(index, genre_ids):
+    """Return the number of movies of each of the given genres.
+
+    The largest of them is a lower bound, and their sum an upper bound,
+    on the number of candidates; both are known before any posting list
+    is read.
+
+    """
+    genre_ids = np.asarray(genre_ids, dtype=np.int64)
+    return index.indptr[genre_ids + 1] - index.indptr[genre_ids]
+
+def genre_candidates(index, rows, cap=None):
+    """Collect the movies sharing at least one genre with the given rows.
+
+    Parameters
+    ----------
+    index : GenreIndex
+        Index built with `build_genre_index`.
+    rows : array-like of int
+        Catalogue rows of the chosen movies.
+    cap : int, optional
+        Largest number of candidates to return. When more movies share a
+        genre, those having every genre of one of the chosen movies are
+        kept first, then the others in catalogue order.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted catalogue rows of the candidates. The chosen movies are
+        included.
+
+    """
+    n_rows = len(index.row_indptr) - 1
+    genre_ids = chosen_genres(index, rows)
+    candidates = union_rows(postings(index, genre_ids), n_rows)
+    if cap is None or candidates.size <= cap:
+        return candidates
+    strong = union_rows([intersect_rows(postings(index, genres_of(index, r)))
+                         for r in rows], n_rows)
+    if strong.size >= cap:
+        return strong[:cap]
+    rest = candidates[~np.isin(candidates, strong)][:cap - strong.size]
+    return np.union1d(strong, rest)
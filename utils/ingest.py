@@ -0,0 +1,129 @@
+"""
+
+    Streaming ingestion of rating datasets.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the sparse user x item rating matrix, the
+    userId/movieId maps and per-movie rating counts and means in a single
+    pass over a ratings file, read in fixed-size chunks. Apart from the
+    compact (int32, int32, float32) triplets of the ratings themselves,
+    memory use does not grow with the size of the file, so the same code
+    handles MovieLens-small and MovieLens-25M.
+
+"""
+# Data handling dependencies
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+RATING_DTYPES = {'userId': 'int32', 'movieId': 'int32', 'rating': 'float32'}
+
+# `matrix` rows follow `user_ids` and its columns follow `item_ids`
+# (both pandas Index objects mapping raw IDs to positions).
+RatingsIndex = namedtuple('RatingsIndex', ['matrix', 'user_ids', 'item_ids',
+                                           'item_count', 'item_mean'])
+
+def csv_chunks(path, chunksize=1_000_000):
+    """Read the rating columns of a CSV file in chunks."""
+    return pd.read_csv(path, usecols=list(RATING_DTYPES), dtype=RATING_DTYPES,
+                       chunksize=chunksize)
+
+def frame_chunks(ratings, chunksize=1_000_000):
+    """Split a ratings dataframe (e.g. a memory-mapped one) into chunks."""
+    for start in range(0, len(ratings), chunksize):
+        yield ratings.iloc[start:start + chunksize]
+
+class _IdMap:
+    """Assigns consecutive positions to raw integer IDs as they appear."""
+
+    def __init__(self):
+        self.lookup = np.full(1024, -1, dtype=np.int32)
+        self.ids = []
+        self.size = 0
+
+    def positions(self, raw):
+        raw = np.asarray(raw, dtype=np.int64)
+        if raw.size and raw.max() >= self.lookup.size:
+            grown = np.full(max(int(raw.max()) + 1, 2 * self.lookup.size),
+                            -1, dtype=np.int32)
+            grown[:self.lookup.size] = self.lookup
+            self.lookup = grown
+        pos = self.lookup[raw]
+        unseen = pos < 0
+        if unseen.any():
+            # Number new IDs in order of first appearance
+            new, first = np.unique(raw[unseen], return_index=True)
+            new = new[np.argsort(first)]
+            self.lookup[new] = np.arange(self.size, self.size + new.size)
+            self.ids.append(new.astype(np.int32))
+            self.size += new.size
+            pos = self.lookup[raw]
+        return pos
+
+    def index(self):
+        ids = np.concatenate(self.ids) if self.ids else np.empty(0, np.int32)
+        return pd.Index(ids)
+
+def ingest_ratings(chunks):
+    """Build the rating matrix and statistics in one pass over the chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of Pandas Dataframe
+        Chunks with 'userId', 'movieId' and 'rating' columns, e.g. from
+        `csv_chunks` or `frame_chunks`. A later rating of the same
+        (user, movie) pair replaces an earlier one.
+
+    Returns
+    -------
+    RatingsIndex
+        CSR float32 rating matrix, ID maps, and per-movie rating counts
+        (int64) and means (float32).
+
+    """
+    users, items = _IdMap(), _IdMap()
+    rows, cols, values = [], [], []
+    for chunk in chunks:
+        rows.append(users.positions(chunk['userId'].values))
+        cols.append(items.positions(chunk['movieId'].values))
+        values.append(np.asarray(chunk['rating'].values, dtype=np.float32))
+    rows = np.concatenate(rows) if rows else np.empty(0, np.int32)
+    cols = np.concatenate(cols) if cols else np.empty(0, np.int32)
+    values = np.concatenate(values) if values else np.empty(0, np.float32)
+
+    # Keep the last rating of duplicated (user, movie) pairs
+    order = np.lexsort((np.arange(rows.size), cols, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    last = np.ones(rows.size, dtype=bool)
+    last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, values = rows[last], cols[last], values[last]
+    del order, last
+
+    # The triplets are sorted by row, so the CSR arrays are built directly
+    indptr = np.zeros(users.size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=users.size), out=indptr[1:])
+    matrix = scipy.sparse.csr_matrix((values, cols, indptr),
+                                     shape=(users.size, items.size))
+    item_count = np.bincount(cols, minlength=items.size)
+    item_sum = np.bincount(cols, weights=values, minlength=items.size)
+    item_mean = np.divide(item_sum, item_count, out=np.zeros(items.size),
+                          where=item_count > 0).astype(np.float32)
+    return RatingsIndex(matrix=matrix, user_ids=users.index(),
+                        item_ids=items.index(), item_count=item_count,
+                        item_mean=item_mean)
+
+def ratings_frame(index):
+    """Expand a RatingsIndex back into a compact ratings dataframe.
+
+    Returns
+    -------
+    Pandas Dataframe
+        'userId', 'movieId' (int32) and 'rating' (float32) columns.
+
+    """
+    coo = index.matrix.tocoo()
+    return pd.DataFrame({'userId': index.user_ids.values[coo.row],
+                         'movieId': index.item_ids.values[coo.col],
+                         'rating': coo.data})
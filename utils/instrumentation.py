@@ -0,0 +1,167 @@
+"""
+
+    Lightweight timing and counting of the recommendation pipeline.
+
+    Author: Explore Data Science Academy.
+
+    Description: Code paths are wrapped in named stages, e.g.
+
+        with stage('content.score'):
+            ...
+
+    and events are counted with `incr`. Timings and counts are aggregated
+    per process and shown on the app's Diagnostics page; worker processes
+    hand theirs over with `drain` and `merge`. Instrumentation is on by
+    default; setting the environment variable
+    `RECOMMENDER_INSTRUMENTATION=0` turns every stage into a shared no-op.
+    `profile_call` captures a cProfile (or, if installed, pyinstrument)
+    report of a single request.
+
+"""
+# Script dependencies
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+ENABLED = os.environ.get('RECOMMENDER_INSTRUMENTATION', '1') != '0'
+
+_lock = threading.Lock()
+# name -> [calls, total seconds, max seconds]
+_timings = {}
+_counters = {}
+_disabled = contextlib.nullcontext()
+
+class _Stage:
+    """Context manager adding its duration to a named stage."""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+def record(name, elapsed):
+    """Add a duration, in seconds, measured elsewhere to a named stage."""
+    if not ENABLED:
+        return
+    with _lock:
+        stats = _timings.get(name)
+        if stats is None:
+            _timings[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+def stage(name):
+    """Time the enclosed block under a stage name."""
+    return _Stage(name) if ENABLED else _disabled
+
+def incr(name, n=1):
+    """Add to a named counter."""
+    if ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+def timings():
+    """Return the aggregated stage timings, in milliseconds.
+
+    Returns
+    -------
+    list (dict)
+        One entry per stage, slowest total first.
+
+    """
+    with _lock:
+        rows = [{'stage': name, 'calls': calls,
+                 'total_ms': total * 1000,
+                 'mean_ms': total * 1000 / calls,
+                 'max_ms': worst * 1000}
+                for name, (calls, total, worst) in _timings.items()]
+    return sorted(rows, key=lambda r: -r['total_ms'])
+
+def counters():
+    """Return a copy of the counters."""
+    with _lock:
+        return dict(_counters)
+
+def reset():
+    """Clear all timings and counters."""
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+def drain():
+    """Return the raw timings and counters, and clear them.
+
+    Lets a worker process hand what it measured since the last call to
+    the process aggregating it, see `merge`.
+
+    Returns
+    -------
+    dict
+        'timings' (name -> [calls, total seconds, max seconds]) and
+        'counters' (name -> count).
+
+    """
+    with _lock:
+        raw = {'timings': dict(_timings), 'counters': dict(_counters)}
+        _timings.clear()
+        _counters.clear()
+    return raw
+
+def merge(raw):
+    """Add timings and counters returned by `drain` to this process's."""
+    if not ENABLED:
+        return
+    with _lock:
+        for name, (calls, total, worst) in raw['timings'].items():
+            stats = _timings.get(name)
+            if stats is None:
+                _timings[name] = [calls, total, worst]
+            else:
+                stats[0] += calls
+                stats[1] += total
+                stats[2] = max(stats[2], worst)
+        for name, n in raw['counters'].items():
+            _counters[name] = _counters.get(name, 0) + n
+
+def profile_call(fn, *args, **kwargs):
+    """Run a single call under a profiler.
+
+    pyinstrument is used when it is installed, cProfile otherwise.
+
+    Returns
+    -------
+    tuple
+        The call's result and the profiler's text report.
+
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(fn, *args, **kwargs)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative') \
+            .print_stats(30)
+        return result, out.getvalue()
+    profiler = Profiler()
+    profiler.start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.stop()
+    return result, profiler.output_text()
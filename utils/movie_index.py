@@ -0,0 +1,81 @@
+"""
+
+    Bidirectional lookups between movie titles, rows and MovieLens IDs.
+
+    Author: Explore Data Science Academy.
+
+    Description: The recommenders receive titles from the app, score
+    movies by row position or MovieLens ID, and return titles again. The
+    index below is built once from the movie catalogue so that every one
+    of these lookups is a hash-table or array access rather than a scan
+    of the catalogue.
+
+"""
+# Data handling dependencies
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# `titles` and `movie_ids` are indexed by catalogue row. `title_rows`
+# maps a title to its first row, and `id_rows` maps a MovieLens ID to its
+# row via `get_indexer`.
+MovieIndex = namedtuple('MovieIndex', ['titles', 'movie_ids', 'title_rows',
+                                       'id_rows'])
+
+def build_movie_index(movies):
+    """Build the lookup tables for a movie catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Catalogue with 'movieId' and 'title' columns.
+
+    Returns
+    -------
+    MovieIndex
+        Lookup tables over the rows of `movies`.
+
+    """
+    titles = np.asarray(movies['title'].values, dtype=object)
+    movie_ids = np.asarray(movies['movieId'].values)
+    title_rows = {}
+    # Keep the first row of duplicated titles
+    for row, title in enumerate(titles):
+        title_rows.setdefault(title, row)
+    return MovieIndex(titles=titles, movie_ids=movie_ids,
+                      title_rows=title_rows, id_rows=pd.Index(movie_ids))
+
+def rows_for_titles(index, titles):
+    """Return the catalogue rows of the given titles.
+
+    Raises
+    ------
+    KeyError
+        If a title is not in the catalogue.
+
+    """
+    return np.array([index.title_rows[title] for title in titles],
+                    dtype=np.int64)
+
+def movie_ids_for_titles(index, titles):
+    """Return the MovieLens IDs of the given titles."""
+    return index.movie_ids[rows_for_titles(index, titles)]
+
+def rows_for_movie_ids(index, movie_ids):
+    """Return the catalogue rows of MovieLens IDs, or -1 where unknown."""
+    movie_ids = np.asarray(movie_ids)
+    # Matching the index dtype, where the IDs fit it, spares pandas a cast
+    # of the whole index on every lookup
+    cast = movie_ids.astype(index.id_rows.dtype)
+    if np.array_equal(cast, movie_ids):
+        movie_ids = cast
+    return index.id_rows.get_indexer(movie_ids)
+
+def titles_for_rows(index, rows):
+    """Return the titles of the given catalogue rows, in order."""
+    return index.titles.take(np.asarray(rows, dtype=np.int64)).tolist()
+
+def titles_for_movie_ids(index, movie_ids):
+    """Return the titles of MovieLens IDs, in order, skipping unknown IDs."""
+    rows = rows_for_movie_ids(index, movie_ids)
+    return titles_for_rows(index, rows[rows >= 0])
@@ -0,0 +1,185 @@
+"""
+
+    Key-value store of precomputed recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: `resources/models/prewarm_recommendations.py` computes
+    recommendations offline for the movie triples selectable in the app
+    and writes them to a SQLite file. Keys hold the algorithm, `top_n` and
+    the sorted catalogue rows of the three movies; values hold the rows of
+    the recommended movies as packed int32 arrays. The store records the
+    size and modification time of the data, model and neighbour index
+    files it was built from, as `utils.shared_arrays` does, and the
+    recommender settings it was built with. The app ignores it when they
+    no longer match, so a store copied to another host is rebuilt there.
+
+"""
+# Script dependencies
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+from utils import registry
+
+STORE_PATH = (registry.ROOT / 'resources' / 'models'
+              / 'precomputed_recommendations.sqlite')
+
+def source_fingerprint():
+    """Return what the stored recommendations depend on.
+
+    Returns
+    -------
+    dict
+        Size and modification time of each data, model and index file
+        (None if missing), and under 'settings' the recommender settings
+        changing results. Files are not hashed, since the first lookup
+        of every serving process computes the fingerprint.
+
+    """
+    # Imported here: the recommenders import this module via the cache
+    from recommenders import collaborative_based, content_based
+    from recommenders.neighbour_index import NEIGHBOUR_ARRAYS
+    paths = [registry.MOVIES_PATH, registry.RATINGS_PATH,
+             registry.SVD_MODEL_PATH,
+             registry.SVD_FACTORS_PATH / 'CURRENT']
+    paths += [content_based.NEIGHBOURS_PATH / (name + '.npy')
+              for name in NEIGHBOUR_ARRAYS]
+    fingerprint = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            stamp = None
+        fingerprint[str(path.relative_to(registry.ROOT))] = stamp
+    fingerprint['settings'] = {
+        'content.CANDIDATE_CAP': content_based.CANDIDATE_CAP,
+        'content.USE_NEIGHBOURS': content_based.USE_NEIGHBOURS,
+        'collaborative.CANDIDATE_CAP': collaborative_based.CANDIDATE_CAP}
+    return fingerprint
+
+def store_key(algorithm, rows, top_n):
+    """Build the key of a request from the catalogue rows of its movies."""
+    return f"{algorithm}:{int(top_n)}:{','.join(str(r) for r in sorted(rows))}"
+
+def encode_rows(rows):
+    """Pack recommended catalogue rows into a compact binary value."""
+    return np.asarray(rows, dtype='<i4').tobytes()
+
+def decode_rows(value):
+    """Unpack a value written by `encode_rows`."""
+    return np.frombuffer(value, dtype='<i4')
+
+class PrecomputedStore:
+    """SQLite-backed store of precomputed recommendations.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Location of the SQLite file.
+    readonly : bool
+        Open the file read-only, as the app does.
+
+    """
+
+    def __init__(self, path=STORE_PATH, readonly=False):
+        self.path = str(path)
+        self.readonly = readonly
+        if readonly:
+            self._conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True,
+                                         check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS recommendations '
+                               '(key TEXT PRIMARY KEY, rows BLOB NOT NULL) '
+                               'WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                               '(name TEXT PRIMARY KEY, value TEXT)')
+            self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the recommended rows stored under a key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT rows FROM recommendations WHERE key = ?',
+                (key,)).fetchone()
+        return None if row is None else decode_rows(row[0])
+
+    def existing(self, keys):
+        """Return the subset of the given keys which are already stored."""
+        found = set()
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                marks = ','.join('?' * len(batch))
+                found.update(k for k, in self._conn.execute(
+                    f'SELECT key FROM recommendations WHERE key IN ({marks})',
+                    batch))
+        return found
+
+    def put_many(self, items):
+        """Store (key, rows) pairs in one transaction."""
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO recommendations VALUES (?, ?)',
+                [(key, encode_rows(rows)) for key, rows in items])
+            self._conn.commit()
+
+    def clear(self):
+        """Delete every stored recommendation."""
+        with self._lock:
+            self._conn.execute('DELETE FROM recommendations')
+            self._conn.commit()
+
+    def get_meta(self, name):
+        """Return a JSON metadata value, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE name = ?',
+                                     (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_meta(self, name, value):
+        """Store a JSON metadata value."""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                               (name, json.dumps(value)))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM recommendations').fetchone()[0]
+
+    def close(self):
+        """Close the store, folding the write-ahead log into the file."""
+        with self._lock:
+            if not self.readonly:
+                self._conn.execute('PRAGMA journal_mode=DELETE')
+            self._conn.close()
+
+def open_store(path=STORE_PATH):
+    """Open the precomputed store for serving.
+
+    Returns
+    -------
+    PrecomputedStore or None
+        The store, or None if it is missing or was built from other data
+        or another model.
+
+    """
+    try:
+        store = PrecomputedStore(path, readonly=True)
+        if store.get_meta('fingerprint') == source_fingerprint():
+            return store
+        store.close()
+    except sqlite3.Error:
+        pass
+    return None
+
+registry.register('precomputed_store', open_store)
@@ -0,0 +1,80 @@
+"""
+
+    Helper functions for ranking similarity scores.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Data handling dependencies
+import numpy as np
+
+def top_k_indices(scores, k, exclude=None):
+    """Select the indices of the k highest scores without a full sort.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        One-dimensional array of scores.
+    k : int
+        Number of indices to return.
+    exclude : array-like of int, optional
+        Indices which may not be returned (e.g. the movies a user chose).
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to k indices, ordered by descending score. Ties are broken by
+        the lower index so that results are deterministic.
+
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude is not None and len(exclude) > 0:
+        scores = scores.copy()
+        scores[np.asarray(exclude, dtype=np.int64)] = -np.inf
+    k = min(int(k), int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        # Partition so that only the candidate block needs sorting. Every
+        # score tied with the k-th best is kept so tie-breaking stays stable.
+        kth = np.partition(scores, scores.size - k)[scores.size - k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(scores.size)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+def top_k_rows(scores, k):
+    """Select the indices of the k highest scores of every row at once.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        (n_rows x n_columns) array of scores. Excluded columns should be
+        set to -inf beforehand.
+    k : int
+        Number of indices to return per row.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n_rows x k) array of column indices, ordered by descending score
+        within each row, and -1 where a row has fewer than k scores above
+        -inf. Within the top k, ties are broken by the lower index;
+        which of several columns tied with the k-th score is kept is
+        unspecified.
+
+    """
+    scores = np.asarray(scores)
+    k = min(int(k), scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    values = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -values), axis=-1)
+    top = np.take_along_axis(top, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    return np.where(values > -np.inf, top, -1)
@@ -0,0 +1,196 @@
+"""
+
+    Shared, lazily-loaded registry of datasets and models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every dataset, model and derived index used by the app is
+    registered here under a name, together with a function that loads it.
+    A resource is only loaded the first time it is requested, is loaded at
+    most once per process (even when Streamlit sessions request it from
+    several threads at the same time), and is then shared by every caller.
+
+"""
+# Script dependencies
+import os
+import pathlib
+import pickle
+import threading
+
+from utils.data_cache import read_csv_cached, read_csv_chunks_cached
+from utils.genre_index import build_genre_index
+from utils.ingest import RATING_DTYPES, frame_chunks, ingest_ratings
+from utils.instrumentation import stage
+from utils.movie_index import build_movie_index
+
+# Paths of the bundled data, relative to the root of the repository
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+MOVIES_PATH = ROOT / 'resources' / 'data' / 'movies.csv'
+RATINGS_PATH = ROOT / 'resources' / 'data' / 'ratings.csv'
+SVD_MODEL_PATH = ROOT / 'resources' / 'models' / 'best_svd_model.pkl'
+SVD_FACTORS_PATH = ROOT / 'resources' / 'models' / 'svd_factors'
+
+# How the ratings are read, and keyed in the columnar cache
+RATINGS_OPTIONS = {'usecols': list(RATING_DTYPES), 'dtype': RATING_DTYPES}
+
+_loaders = {}
+# Loaders which take precedence over `_loaders`, see `attach`
+_attached = {}
+_resources = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def register(name, loader):
+    """Register a function which loads a named resource.
+
+    Registering a name again replaces its loader and drops any copy of
+    the resource which has already been loaded.
+
+    Parameters
+    ----------
+    name : str
+        Name under which the resource is requested.
+    loader : callable
+        Function without arguments which returns the resource.
+
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _resources.pop(name, None)
+
+def attach(name, loader):
+    """Load a resource from a shared copy instead of its registered loader.
+
+    Unlike `register`, the attached loader is kept when the resource's
+    module registers its own loader later on. See `utils.shared_arrays`.
+
+    Parameters
+    ----------
+    name : str
+        Name under which the resource is requested.
+    loader : callable
+        Function without arguments which returns the resource.
+
+    """
+    with _registry_lock:
+        _attached[name] = loader
+        _resources.pop(name, None)
+
+def detach(name=None):
+    """Go back to the registered loader of a resource (or of all of them)."""
+    with _registry_lock:
+        names = list(_attached) if name is None else [name]
+        for name in names:
+            _attached.pop(name, None)
+            _resources.pop(name, None)
+
+def registered_loader(name):
+    """Return the loader registered for a resource, ignoring `attach`."""
+    return _loaders[name]
+
+def get(name):
+    """Return a named resource, loading it on first use.
+
+    Parameters
+    ----------
+    name : str
+        Name of a registered resource.
+
+    Returns
+    -------
+    object
+        The shared resource.
+
+    """
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _registry_lock:
+        loader = _attached.get(name, _loaders.get(name))
+        if loader is None:
+            raise KeyError(f"No resource registered as '{name}'.")
+        lock = _locks.setdefault(name, threading.Lock())
+    # Only one thread loads a given resource; the others wait for it
+    with lock:
+        if name not in _resources:
+            with stage(f'load.{name}'):
+                _resources[name] = loader()
+        return _resources[name]
+
+def clear(name=None):
+    """Drop a loaded resource (or all of them) so it is reloaded on next use."""
+    with _registry_lock:
+        if name is None:
+            _resources.clear()
+        else:
+            _resources.pop(name, None)
+
+def loaded():
+    """Return the names of the resources loaded so far."""
+    return sorted(_resources)
+
+def load_movies():
+    """Load the movie catalogue with compact column types.
+
+    Returns
+    -------
+    Pandas Dataframe
+        'movieId' (int32), 'title' and 'genres' (categorical) columns,
+        with rows holding missing values dropped.
+
+    """
+    movies = read_csv_cached(MOVIES_PATH,
+                             dtype={'movieId': 'int32', 'title': 'object',
+                                    'genres': 'category'})
+    if movies.isna().values.any():
+        movies = movies.dropna().reset_index(drop=True)
+    return movies
+
+def load_ratings():
+    """Load the user ratings with compact column types.
+
+    Returns
+    -------
+    Pandas Dataframe
+        'userId', 'movieId' (int32) and 'rating' (float32) columns.
+
+    """
+    return read_csv_cached(RATINGS_PATH, **RATINGS_OPTIONS)
+
+def load_ratings_index():
+    """Build the sparse rating matrix and statistics in one pass.
+
+    The ratings are streamed from the loaded ratings, when there are
+    any, or else through the columnar cache: the first read of the CSV
+    file goes in chunks and builds the cache on the way, so that the file
+    is never held in memory as a whole and later processes memory-map it.
+
+    Returns
+    -------
+    RatingsIndex
+        See `utils.ingest.ingest_ratings`.
+
+    """
+    ratings = _resources.get('ratings')
+    if ratings is None:
+        return ingest_ratings(read_csv_chunks_cached(RATINGS_PATH,
+                                                     **RATINGS_OPTIONS))
+    return ingest_ratings(frame_chunks(ratings))
+
+def load_svd_model():
+    """Unpickle the trained surprise SVD model."""
+    with open(SVD_MODEL_PATH, 'rb') as f:
+        return pickle.load(f)
+
+register('movies', load_movies)
+register('ratings', load_ratings)
+register('svd_model', load_svd_model)
+register('movie_index', lambda: build_movie_index(get('movies')))
+register('genre_index', lambda: build_genre_index(get('movies')))
+register('ratings_index', load_ratings_index)
+
+# Worker processes attach to the arrays published by a loader process
+if os.environ.get('RECOMMENDER_SHARED_DIR'):
+    from utils.shared_arrays import attach_published
+    attach_published(os.environ['RECOMMENDER_SHARED_DIR'])
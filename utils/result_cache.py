@@ -0,0 +1,278 @@
+"""
+
+    Cache of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: The app only offers a few hundred titles per favourite
+    movie, so the same requests come up again and again. Results are
+    cached per algorithm, `top_n` and set of chosen movies (the order in
+    which they were chosen does not change the result). The cache holds a
+    bounded number of entries, evicts the least recently used one when
+    full, and expires entries after a time-to-live. It is emptied, along
+    with the shared data registry, when the model or data files change
+    (including when a new model version is published), so the next
+    request loads the new files. A change to the precomputed store only
+    reopens the store.
+
+    On a miss, the store of precomputed recommendations written by
+    `resources/models/prewarm_recommendations.py` is checked before the
+    recommender itself runs.
+
+"""
+# Script dependencies
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils import registry
+from utils.instrumentation import incr, stage
+from utils.movie_index import rows_for_titles, titles_for_rows
+from utils.precomputed import STORE_PATH, store_key
+
+def recommendation_key(algorithm, movie_list, top_n):
+    """Build the cache key of a recommendation request."""
+    return (algorithm, tuple(sorted(movie_list)), int(top_n))
+
+class RecommendationCache:
+    """Thread-safe LRU cache with time-to-live expiry and hit counters.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of cached results.
+    ttl : float
+        Seconds after which a cached result expires.
+    watch : list (str), optional
+        Files whose modification invalidates every cached result.
+
+    """
+
+    def __init__(self, max_size=4096, ttl=3600.0, watch=()):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.watch = list(watch)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = self._stat_watched()
+
+    def _stat_watched(self):
+        """Return the size and modification time of the watched files."""
+        stats = []
+        for path in self.watch:
+            try:
+                st = os.stat(path)
+                stats.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+        return tuple(stats)
+
+    def check_files(self):
+        """Empty the cache if a watched file changed.
+
+        Returns
+        -------
+        list
+            The watched files which changed, empty if the cache was not
+            invalidated.
+
+        """
+        fingerprint = self._stat_watched()
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return []
+            changed = [path for path, old, new in
+                       zip(self.watch, self._fingerprint, fingerprint)
+                       if old != new]
+            self._fingerprint = fingerprint
+            self._entries.clear()
+        return changed
+
+    def get(self, key):
+        """Look up a cached result.
+
+        Returns
+        -------
+        tuple
+            (True, result) on a hit, (False, None) on a miss.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """Cache a result, evicting the least recently used if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+# Shared by every recommender in the process
+recommendation_cache = RecommendationCache(
+    watch=[registry.MOVIES_PATH, registry.RATINGS_PATH,
+           registry.SVD_MODEL_PATH,
+           registry.SVD_FACTORS_PATH / 'CURRENT', STORE_PATH])
+
+def lookup_precomputed(algorithm, movie_list, top_n):
+    """Look a request up in the store of precomputed recommendations.
+
+    Returns
+    -------
+    list (str) or None
+        The stored titles, or None if the store is unavailable or does
+        not hold the request.
+
+    """
+    store = registry.get('precomputed_store')
+    if store is None:
+        return None
+    movie_index = registry.get('movie_index')
+    try:
+        rows = rows_for_titles(movie_index, movie_list)
+    except KeyError:
+        return None
+    try:
+        stored = store.get(store_key(algorithm, rows, top_n))
+    except sqlite3.ProgrammingError:
+        # Closed by another thread because the store file changed
+        return None
+    return None if stored is None else titles_for_rows(movie_index, stored)
+
+def _cached_result(cache, algorithm, movie_list, top_n):
+    """Answer a request from the cache or the precomputed store.
+
+    Returns
+    -------
+    tuple
+        The cache key, and the titles or None on a miss.
+
+    """
+    key = recommendation_key(algorithm, movie_list, top_n)
+    hit, result = cache.get(key)
+    if hit:
+        incr(f'{algorithm}.cache_hits')
+        return key, result
+    with stage(f'{algorithm}.precomputed'):
+        result = lookup_precomputed(algorithm, movie_list, top_n)
+    if result is not None:
+        incr(f'{algorithm}.precomputed_hits')
+        result = tuple(result)
+        cache.put(key, result)
+    return key, result
+
+def _close_store():
+    """Close the loaded precomputed store, reopening it on next use."""
+    if 'precomputed_store' not in registry.loaded():
+        return
+    store = registry.get('precomputed_store')
+    registry.clear('precomputed_store')
+    if store is not None:
+        store.close()
+
+def _check_files(cache):
+    changed = cache.check_files()
+    if not changed:
+        return
+    # A write to the precomputed store, e.g. by a prewarm run, only
+    # reopens the store
+    _close_store()
+    if any(path != STORE_PATH for path in changed):
+        # The data or model changed: reload them on next use
+        registry.clear()
+    incr('cache.invalidations')
+
+def cached_recommendations(algorithm, cache=recommendation_cache):
+    """Decorate a `*_model(movie_list, top_n)` function with the cache.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm, part of the cache key.
+    cache : RecommendationCache
+        Cache to use. Defaults to the shared cache.
+
+    """
+    def decorator(model_fn):
+        @functools.wraps(model_fn)
+        def wrapper(movie_list, top_n=10):
+            _check_files(cache)
+            key, result = _cached_result(cache, algorithm, movie_list, top_n)
+            if result is None:
+                incr(f'{algorithm}.computed')
+                with stage(f'{algorithm}.compute'):
+                    result = tuple(model_fn(movie_list, top_n))
+                cache.put(key, result)
+            return list(result)
+        return wrapper
+    return decorator
+
+def cached_batch_recommendations(algorithm, cache=recommendation_cache):
+    """Decorate a `*_model_batch(movie_lists, top_n)` function with the cache.
+
+    Requests found in the cache or the precomputed store are answered
+    directly; the others are passed to the batch function in a single
+    call. Batch and single-request functions of an algorithm share their
+    cache entries.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm, part of the cache key.
+    cache : RecommendationCache
+        Cache to use. Defaults to the shared cache.
+
+    """
+    def decorator(batch_fn):
+        @functools.wraps(batch_fn)
+        def wrapper(movie_lists, top_n=10):
+            _check_files(cache)
+            results = []
+            missing = []
+            for i, movie_list in enumerate(movie_lists):
+                key, result = _cached_result(cache, algorithm, movie_list,
+                                             top_n)
+                if result is None:
+                    missing.append((i, key))
+                results.append(result)
+            if missing:
+                incr(f'{algorithm}.computed', len(missing))
+                with stage(f'{algorithm}.compute_batch'):
+                    computed = batch_fn([movie_lists[i] for i, _ in missing],
+                                        top_n)
+                for (i, key), result in zip(missing, computed):
+                    results[i] = tuple(result)
+                    cache.put(key, results[i])
+            return [list(result) for result in results]
+        return wrapper
+    return decorator
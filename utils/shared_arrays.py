@@ -0,0 +1,221 @@
+"""
+
+    Share the numeric data and models between processes on one host.
+
+    Author: Explore Data Science Academy.
+
+    Description: By default every app or worker process loads its own
+    copy of the ratings, the SVD model and the indexes built from them.
+    Instead, one loader process can publish the numeric arrays of these
+    resources as `.npy` files, by default in shared memory (`/dev/shm`):
+
+        python -m utils.shared_arrays --dir /dev/shm/edsa-recommender
+
+    Processes started with the environment variable
+    `RECOMMENDER_SHARED_DIR` set to the published folder then memory-map
+    the arrays read-only rather than loading the resources themselves,
+    so the operating system keeps a single copy of them whatever the
+    number of processes. Python objects such as the movie titles are not
+    shared.
+
+    A published snapshot records the size and modification time of the
+    data and model files. If these change, processes fall back to
+    loading the resources themselves until the arrays are published
+    again.
+
+"""
+# Script dependencies
+import argparse
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from utils import registry
+
+MANIFEST = 'manifest.json'
+FORMAT = 'edsa-shared-arrays'
+
+# Resources published by default, with the modules registering them
+DEFAULT_RESOURCES = {'svd_factors': 'recommenders.collaborative_based',
+                     'item_index': 'recommenders.collaborative_based',
+                     'ratings_index': 'utils.registry',
+                     'genre_index': 'utils.registry',
+                     'content_index': 'recommenders.content_based',
+                     'content_neighbours': 'recommenders.content_based',
+                     'hybrid_features': 'recommenders.hybrid_based'}
+
+def default_dir():
+    """Return the default folder to publish to, in shared memory if any."""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'edsa-recommender')
+
+def source_stamp():
+    """Return the size and modification time of the source files."""
+    paths = [registry.MOVIES_PATH, registry.RATINGS_PATH,
+             registry.SVD_MODEL_PATH, registry.SVD_FACTORS_PATH / 'CURRENT']
+    stamp = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp[path.name] = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            stamp[path.name] = None
+    return stamp
+
+def _encode(value, folder, prefix):
+    """Save the arrays of a value and return its JSON description."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {'type': 'value', 'value': value}
+    if isinstance(value, np.generic):
+        return {'type': 'value', 'value': value.item()}
+    if isinstance(value, (scipy.sparse.csr_matrix, scipy.sparse.csr_array)):
+        return {'type': 'csr', 'shape': list(value.shape),
+                **{part: _encode(getattr(value, part), folder,
+                                 f'{prefix}.{part}')
+                   for part in ('data', 'indices', 'indptr')}}
+    if isinstance(value, pd.Index):
+        return {'type': 'index',
+                'values': _encode(value.to_numpy(), folder, prefix)}
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError(f"'{prefix}' holds Python objects")
+        np.save(os.path.join(folder, prefix + '.npy'),
+                np.ascontiguousarray(value))
+        return {'type': 'array', 'file': prefix + '.npy'}
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        return {'type': 'namedtuple', 'module': type(value).__module__,
+                'name': type(value).__name__,
+                'fields': {field: _encode(item, folder, f'{prefix}.{field}')
+                           for field, item in zip(value._fields, value)}}
+    if isinstance(value, (tuple, list)):
+        return {'type': 'list',
+                'items': [_encode(item, folder, f'{prefix}.{i}')
+                          for i, item in enumerate(value)]}
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {'type': 'dict',
+                'items': {k: _encode(item, folder, f'{prefix}.{k}')
+                          for k, item in value.items()}}
+    raise TypeError(f"Cannot share '{prefix}' of type {type(value)}")
+
+def _decode(spec, folder):
+    """Rebuild a value from its description, memory-mapping its arrays."""
+    kind = spec['type']
+    if kind == 'value':
+        return spec['value']
+    if kind == 'array':
+        return np.load(os.path.join(folder, spec['file']), mmap_mode='r')
+    if kind == 'csr':
+        return scipy.sparse.csr_matrix(
+            (_decode(spec['data'], folder), _decode(spec['indices'], folder),
+             _decode(spec['indptr'], folder)), shape=tuple(spec['shape']))
+    if kind == 'index':
+        return pd.Index(_decode(spec['values'], folder), copy=False)
+    if kind == 'namedtuple':
+        cls = getattr(importlib.import_module(spec['module']), spec['name'])
+        return cls(**{field: _decode(item, folder)
+                      for field, item in spec['fields'].items()})
+    if kind == 'list':
+        return tuple(_decode(item, folder) for item in spec['items'])
+    if kind == 'dict':
+        return {k: _decode(item, folder) for k, item in spec['items'].items()}
+    raise ValueError(f"Unknown shared value type '{kind}'")
+
+def publish(folder=None, names=None):
+    """Load resources and publish their arrays to a folder.
+
+    The folder is written next to its destination and renamed into
+    place, so attaching processes never see a partial snapshot.
+
+    Parameters
+    ----------
+    folder : str, optional
+        Destination folder. Defaults to `default_dir()`.
+    names : list (str), optional
+        Resources to publish. Defaults to `DEFAULT_RESOURCES`.
+
+    Returns
+    -------
+    str
+        The folder the arrays were published to.
+
+    """
+    folder = os.path.abspath(folder or default_dir())
+    names = list(DEFAULT_RESOURCES if names is None else names)
+    for name in names:
+        importlib.import_module(DEFAULT_RESOURCES.get(name, 'utils.registry'))
+    parent = os.path.dirname(folder)
+    os.makedirs(parent, exist_ok=True)
+    build = tempfile.mkdtemp(dir=parent, prefix='.shared-')
+    manifest = {'format': FORMAT, 'stamp': source_stamp(), 'resources': {}}
+    for name in names:
+        manifest['resources'][name] = _encode(registry.get(name), build, name)
+    with open(os.path.join(build, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.chmod(build, 0o755)
+    if os.path.exists(folder):
+        # Processes already attached keep their open memory maps
+        old = tempfile.mkdtemp(dir=parent, prefix='.shared-old-')
+        os.replace(folder, os.path.join(old, 'snapshot'))
+        os.replace(build, folder)
+        shutil.rmtree(old)
+    else:
+        os.replace(build, folder)
+    return folder
+
+def _read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get('format') == FORMAT else None
+
+def _attached_loader(folder, name):
+    def load():
+        # Reading the manifest on every load picks up republished arrays
+        manifest = _read_manifest(folder)
+        if (manifest is None or name not in manifest['resources']
+                or manifest['stamp'] != source_stamp()):
+            # Missing or stale since publishing: load it ourselves
+            importlib.import_module(DEFAULT_RESOURCES.get(name,
+                                                          'utils.registry'))
+            return registry.registered_loader(name)()
+        return _decode(manifest['resources'][name], folder)
+    return load
+
+def attach_published(folder):
+    """Attach this process to the resources published in a folder.
+
+    Parameters
+    ----------
+    folder : str
+        Folder written by `publish`.
+
+    Returns
+    -------
+    list (str)
+        Names of the attached resources; empty if nothing is published.
+
+    """
+    manifest = _read_manifest(folder)
+    if manifest is None:
+        return []
+    for name in manifest['resources']:
+        registry.attach(name, _attached_loader(folder, name))
+    return sorted(manifest['resources'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the numeric data '
+                                     'and models for other processes.')
+    parser.add_argument('--dir', default=None,
+                        help='Folder to publish to (default: %s)'
+                             % default_dir())
+    args = parser.parse_args()
+    path = publish(args.dir)
+    print(f'Published to {path}; start the app or workers with '
+          f'RECOMMENDER_SHARED_DIR={path}')